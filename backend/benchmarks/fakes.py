@@ -0,0 +1,254 @@
+import io
+import json
+import threading
+import time
+from botocore.exceptions import ClientError, EventStreamError
+from botocore.response import StreamingBody
+
+# Stand-ins for the AWS clients used by the streaming handlers. They are
+# installed through clients.set_client / websocket.set_gateway_client and
+# record when each event happened so the benchmark can compute latencies.
+
+
+class FakeEventStream:
+    """
+    Iterable replay of converse_stream events. Text deltas are paced by the
+    owning FakeBedrockRuntime; close() stops the replay like the botocore
+    EventStream does.
+    """
+
+    def __init__(self, events, first_token_delay, token_interval, sleep=time.sleep):
+        self.events = events
+        self.first_token_delay = first_token_delay
+        self.token_interval = token_interval
+        self.sleep = sleep
+        self.closed = False
+        self.started_at = time.perf_counter()
+        self.first_delta_at = None
+        self.last_event_at = None
+        self.deltas = 0
+
+    def __iter__(self):
+        for event in self.events:
+            if self.closed:
+                return
+            if 'contentBlockDelta' in event:
+                self._wait_for_next_delta()
+                self.deltas += 1
+                if self.first_delta_at is None:
+                    self.first_delta_at = time.perf_counter()
+            self.last_event_at = time.perf_counter()
+            yield event
+
+    def _wait_for_next_delta(self):
+        # Deltas are due at fixed offsets from the start of the stream, so time
+        # the consumer spends per event does not slow the producer down
+        due = self.started_at + self.first_token_delay + self.deltas * self.token_interval
+        remaining = due - time.perf_counter()
+        if remaining > 0:
+            self.sleep(remaining)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeBedrockRuntime:
+    """
+    Bedrock runtime that answers converse_stream with a scripted event
+    sequence, or with `tokens` deltas of token_text, delivered at
+    tokens_per_second after first_token_ms
+    """
+
+    def __init__(self, script=None, tokens=200, tokens_per_second=50.0, first_token_ms=300.0,
+                 token_text='lorem ', input_tokens=1000):
+        self.script = script
+        self.tokens = tokens
+        self.tokens_per_second = tokens_per_second
+        self.first_token_ms = first_token_ms
+        self.token_text = token_text
+        self.input_tokens = input_tokens
+        self.streams = []
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def events(self):
+        if self.script is not None:
+            return list(self.script)
+        events = [{'messageStart': {'role': 'assistant'}}]
+        events.extend(
+            {'contentBlockDelta': {'contentBlockIndex': 0, 'delta': {'text': self.token_text}}}
+            for _ in range(self.tokens)
+        )
+        events.extend([
+            {'contentBlockStop': {'contentBlockIndex': 0}},
+            {'messageStop': {'stopReason': 'end_turn'}},
+            {'metadata': {
+                'usage': {
+                    'inputTokens': self.input_tokens,
+                    'outputTokens': self.tokens,
+                    'totalTokens': self.input_tokens + self.tokens
+                },
+                'metrics': {'latencyMs': int(self.first_token_ms + 1000.0 * self.tokens / self.tokens_per_second)}
+            }}
+        ])
+        return events
+
+    def converse_stream(self, modelId=None, messages=None, inferenceConfig=None, **kwargs):
+        stream = FakeEventStream(
+            self.events(),
+            self.first_token_ms / 1000.0,
+            1.0 / self.tokens_per_second if self.tokens_per_second else 0.0
+        )
+        with self._lock:
+            self.calls += 1
+            self.streams.append(stream)
+        return {'stream': stream}
+
+    def converse(self, modelId=None, messages=None, inferenceConfig=None, **kwargs):
+        text = ''.join(
+            event['contentBlockDelta']['delta'].get('text', '')
+            for event in self.converse_stream(modelId, messages, inferenceConfig)['stream']
+            if 'contentBlockDelta' in event
+        )
+        return {
+            'output': {'message': {'role': 'assistant', 'content': [{'text': text}]}},
+            'stopReason': 'end_turn',
+            'usage': {'inputTokens': self.input_tokens, 'outputTokens': self.tokens,
+                      'totalTokens': self.input_tokens + self.tokens}
+        }
+
+
+class FakeThrottlingBedrockRuntime(FakeBedrockRuntime):
+    """
+    FakeBedrockRuntime with a capacity: calls beyond requests_per_second in
+    any one-second window fail with ThrottlingException, as do the first
+    throttle_first calls. With in_stream=True the throttle is raised while
+    reading the stream, before the first delta, like Bedrock's
+    throttlingException event.
+    """
+
+    def __init__(self, requests_per_second=None, throttle_first=0, in_stream=False, **kwargs):
+        super().__init__(**kwargs)
+        self.requests_per_second = requests_per_second
+        self.throttle_first = throttle_first
+        self.in_stream = in_stream
+        self.throttled = 0
+        self._accepted = []
+
+    def _should_throttle(self):
+        now = time.perf_counter()
+        with self._lock:
+            self._accepted = [at for at in self._accepted if now - at < 1.0]
+            if self.throttle_first > 0:
+                self.throttle_first -= 1
+            elif self.requests_per_second is None or len(self._accepted) < self.requests_per_second:
+                self._accepted.append(now)
+                return False
+            self.throttled += 1
+            return True
+
+    def converse_stream(self, modelId=None, messages=None, inferenceConfig=None, **kwargs):
+        if not self._should_throttle():
+            return super().converse_stream(modelId, messages, inferenceConfig, **kwargs)
+        if not self.in_stream:
+            raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Too many requests'}},
+                              'ConverseStream')
+        with self._lock:
+            self.calls += 1
+        return {'stream': self._throttled_stream()}
+
+    def _throttled_stream(self):
+        yield {'messageStart': {'role': 'assistant'}}
+        raise EventStreamError({'Error': {'Code': 'throttlingException', 'Message': 'Too many requests'}},
+                               'ConverseStream')
+
+
+class FakeKnowledgeBase:
+    """
+    bedrock-agent-runtime stand-in answering retrieve after latency_ms
+    """
+
+    def __init__(self, latency_ms=150.0, text='Retrieved context.'):
+        self.latency_ms = latency_ms
+        self.text = text
+        self.calls = 0
+
+    def retrieve(self, knowledgeBaseId=None, retrievalQuery=None, retrievalConfiguration=None, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency_ms / 1000.0)
+        return {'retrievalResults': [{'content': {'text': self.text}}]}
+
+
+class FakeS3:
+    """
+    S3 stand-in returning the same document for every key
+    """
+
+    def __init__(self, body=b'%PDF-1.4 benchmark document'):
+        self.body = body
+        self.calls = 0
+
+    def get_object(self, Bucket=None, Key=None, **kwargs):
+        self.calls += 1
+        return {'Body': StreamingBody(io.BytesIO(self.body), len(self.body)), 'ContentLength': len(self.body)}
+
+    def head_object(self, Bucket=None, Key=None, **kwargs):
+        self.calls += 1
+        return {'ContentLength': len(self.body), 'ETag': '"benchmark"', 'Metadata': {}}
+
+
+class _GatewayExceptions:
+    class GoneException(Exception):
+        pass
+
+
+class FakeApiGateway:
+    """
+    API Gateway Management API stand-in that records every post_to_connection
+    call and holds each one for latency_ms. Posts to connections in
+    gone_connections raise GoneException.
+    """
+
+    exceptions = _GatewayExceptions
+
+    def __init__(self, latency_ms=20.0, gone_connections=()):
+        self.latency_ms = latency_ms
+        self.gone_connections = set(gone_connections)
+        self.posts = []
+        self._lock = threading.Lock()
+
+    def post_to_connection(self, ConnectionId=None, Data=None, **kwargs):
+        started_at = time.perf_counter()
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        if ConnectionId in self.gone_connections:
+            raise self.exceptions.GoneException(f'{ConnectionId} is gone')
+        finished_at = time.perf_counter()
+        with self._lock:
+            self.posts.append({
+                'connectionId': ConnectionId,
+                'startedAt': started_at,
+                'receivedAt': finished_at,
+                'bytes': len(Data),
+                'message': json.loads(Data)
+            })
+        return {}
+
+    def reset(self):
+        with self._lock:
+            posts, self.posts = self.posts, []
+        return posts
+
+
+class FakeContext:
+    """
+    Minimal Lambda context
+    """
+
+    def __init__(self, function_name='benchmark', timeout_ms=300000):
+        self.function_name = function_name
+        self.aws_request_id = 'benchmark'
+        self._deadline = time.monotonic() + timeout_ms / 1000.0
+
+    def get_remaining_time_in_millis(self):
+        return int((self._deadline - time.monotonic()) * 1000)
@@ -0,0 +1,318 @@
+# Offline benchmark of the streaming Lambda handlers. Bedrock, the Knowledge
+# Base, S3 and API Gateway are replaced by the fakes in fakes.py, so it runs
+# without AWS access:
+#
+#   python benchmarks/streaming_benchmark.py --iterations 5 --output results.json
+#   python benchmarks/streaming_benchmark.py --baseline results.json
+#   python benchmarks/streaming_benchmark.py --throttle-rps 2 --throttle-in-stream
+#
+# Results are JSON: per scenario, percentiles of each latency metric and the
+# number of calls made to each fake.
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import sys
+import time
+import fakes
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_DIR = os.path.join(BACKEND_DIR, 'lambda')
+DOMAIN_NAME = 'benchmark.execute-api.local/prod'
+CONNECTION_ID = 'benchmark-connection'
+
+SCENARIOS = ('generate-text-response', 'process-image-bedrock', 'websocket-send-message')
+
+# p50 metrics compared against a baseline; all are lower-is-better
+REGRESSION_METRICS = ('ttftMs', 'handlerMs', 'tailMs', 'postLatencyMs')
+
+
+def configure_environment():
+    """
+    Settings the handlers read at import time: no caches, no DynamoDB, direct
+    API Gateway posts
+    """
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+    os.environ.setdefault('POWERTOOLS_LOG_LEVEL', 'WARNING')
+    os.environ.update({
+        'MODEL_ID': 'benchmark-model',
+        'EMBEDDING_MODEL_ID': 'benchmark-embedding-model',
+        'BUCKET_NAME': 'benchmark-bucket',
+        'WEBSOCKET_SEND_MODE': 'direct',
+        'RESPONSE_CACHE_ENABLED': 'false',
+        'RETRIEVAL_CACHE_ENABLED': 'false',
+        'METRICS_SINK': 'local',
+    })
+    for name in ('JOBS_TABLE_NAME', 'CACHE_TABLE_NAME', 'CONNECTIONS_TABLE_NAME', 'IMPORT_TIME_REPORT'):
+        os.environ.pop(name, None)
+    sys.path.insert(0, os.path.join(LAMBDA_DIR, 'shared'))
+
+def load_handler(function_dir):
+    """
+    Import a function's app.py under a unique module name, with its own
+    directory importable for function-local modules
+    """
+    path = os.path.join(LAMBDA_DIR, function_dir)
+    sys.path.insert(0, path)
+    spec = importlib.util.spec_from_file_location(function_dir.replace('-', '_'), os.path.join(path, 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.lambda_handler
+
+def percentiles(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def rank(p):
+        position = (len(ordered) - 1) * p / 100.0
+        lower = int(position)
+        upper = min(lower + 1, len(ordered) - 1)
+        return round(ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower), 3)
+
+    return {
+        'count': len(ordered),
+        'min': round(ordered[0], 3),
+        'p50': rank(50),
+        'p90': rank(90),
+        'p99': rank(99),
+        'max': round(ordered[-1], 3),
+        'mean': round(sum(ordered) / len(ordered), 3)
+    }
+
+def ms(seconds):
+    return seconds * 1000.0
+
+def stream_metrics(started_at, finished_at, posts, stream, tokens):
+    """
+    Client-side view of one streamed invocation
+    """
+    chunk_posts = [post for post in posts if post['message'].get('chunk')]
+    done_posts = [post for post in posts if post['message'].get('done')]
+    run = {
+        'handlerMs': ms(finished_at - started_at),
+        'frames': len(posts),
+        'bytes': sum(post['bytes'] for post in posts),
+        'postLatencyMs': [ms(post['receivedAt'] - post['startedAt']) for post in posts],
+        'interFrameGapMs': [ms(later['receivedAt'] - earlier['receivedAt'])
+                            for earlier, later in zip(chunk_posts, chunk_posts[1:])]
+    }
+    if chunk_posts:
+        run['ttftMs'] = ms(chunk_posts[0]['receivedAt'] - started_at)
+        if stream is not None and stream.first_delta_at is not None:
+            # Time between Bedrock producing the first token and the client receiving it
+            run['firstTokenOverheadMs'] = ms(chunk_posts[0]['receivedAt'] - stream.first_delta_at)
+    if done_posts:
+        done_at = done_posts[-1]['receivedAt']
+        if chunk_posts and done_at > chunk_posts[0]['receivedAt']:
+            run['deliveredTokensPerSecond'] = tokens / (done_at - chunk_posts[0]['receivedAt'])
+        if stream is not None and stream.last_event_at is not None:
+            run['tailMs'] = ms(done_at - stream.last_event_at)
+    if stream is not None and stream.deltas:
+        run['perChunkOverheadMs'] = ms((finished_at - started_at) - (stream.last_event_at - stream.started_at)) / stream.deltas
+    return run
+
+def summarize(runs, counts):
+    metrics = {}
+    for run in runs:
+        for name, value in run.items():
+            metrics.setdefault(name, []).extend(value if isinstance(value, list) else [value])
+    return {
+        'runs': len(runs),
+        'metrics': {name: percentiles(values) for name, values in sorted(metrics.items())},
+        'counts': counts
+    }
+
+def run_streaming(handler, event_for, bedrock, gateway, iterations, tokens):
+    runs = []
+    for iteration in range(iterations):
+        gateway.reset()
+        event = event_for(iteration)
+        streams_before = len(bedrock.streams)
+        started_at = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            handler(event, fakes.FakeContext())
+        finished_at = time.perf_counter()
+        new_streams = bedrock.streams[streams_before:]
+        runs.append(stream_metrics(started_at, finished_at, gateway.reset(),
+                                   new_streams[-1] if new_streams else None, tokens))
+    return runs
+
+def bench_generate_text_response(args, bedrock, kb, s3, gateway):
+    handler = load_handler('generate-text-response')
+    before = (bedrock.calls, kb.calls)
+    runs = run_streaming(handler, lambda iteration: {
+        'connectionId': CONNECTION_ID,
+        'domainName': DOMAIN_NAME,
+        'bedrockKBID': 'benchmark-kb',
+        'prompt': f'Benchmark question {iteration}',
+        'prompt_template': 'Context: {context}\nQuestion: {question}',
+        'jobId': f'benchmark-text-{iteration}'
+    }, bedrock, gateway, args.iterations, args.tokens)
+    counts = {
+        'bedrockCalls': bedrock.calls - before[0],
+        'retrieveCalls': kb.calls - before[1],
+        'postToConnectionCalls': sum(run['frames'] for run in runs)
+    }
+    return summarize(runs, counts)
+
+def bench_process_image_bedrock(args, bedrock, kb, s3, gateway):
+    handler = load_handler('process-image-bedrock')
+    before = (bedrock.calls, s3.calls)
+    runs = run_streaming(handler, lambda iteration: {
+        'connectionId': CONNECTION_ID,
+        'domainName': DOMAIN_NAME,
+        'prompt': f'Benchmark evaluation {iteration}',
+        's3FileKey': 'benchmark.pdf',
+        'jobId': f'benchmark-pdf-{iteration}'
+    }, bedrock, gateway, args.iterations, args.tokens)
+    counts = {
+        'bedrockCalls': bedrock.calls - before[0],
+        's3Calls': s3.calls - before[1],
+        'postToConnectionCalls': sum(run['frames'] for run in runs)
+    }
+    return summarize(runs, counts)
+
+def bench_websocket_send_message(args, bedrock, kb, s3, gateway):
+    handler = load_handler('websocket-send-message')
+    gateway.reset()
+    durations = []
+    message = {'chunk': 'x' * args.message_chars, 'done': False}
+    for seq in range(args.messages):
+        started_at = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            handler({
+                'connectionId': CONNECTION_ID,
+                'domainName': DOMAIN_NAME,
+                'message': dict(message, seq=seq)
+            }, fakes.FakeContext())
+        durations.append(ms(time.perf_counter() - started_at))
+    posts = gateway.reset()
+    run = {
+        'handlerMs': durations,
+        'postLatencyMs': [ms(post['receivedAt'] - post['startedAt']) for post in posts],
+        # Handler time not spent waiting on API Gateway
+        'overheadMs': [duration - ms(post['receivedAt'] - post['startedAt'])
+                       for duration, post in zip(durations, posts)]
+    }
+    return summarize([run], {'handlerCalls': len(durations), 'postToConnectionCalls': len(posts)})
+
+BENCHMARKS = {
+    'generate-text-response': bench_generate_text_response,
+    'process-image-bedrock': bench_process_image_bedrock,
+    'websocket-send-message': bench_websocket_send_message,
+}
+
+def compare(results, baseline, tolerance):
+    """
+    Return the p50 metrics that got worse than the baseline by more than
+    tolerance (a fraction)
+    """
+    regressions = []
+    for scenario, summary in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(scenario)
+        if previous is None:
+            continue
+        for metric in REGRESSION_METRICS:
+            current = (summary['metrics'].get(metric) or {}).get('p50')
+            before = (previous['metrics'].get(metric) or {}).get('p50')
+            if current is None or not before:
+                continue
+            if current > before * (1 + tolerance):
+                regressions.append({'scenario': scenario, 'metric': metric, 'baselineP50': before,
+                                    'p50': current, 'change': round(current / before - 1, 3)})
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark of the streaming Lambda handlers")
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--iterations', type=int, default=5, help="Invocations per streaming scenario")
+    parser.add_argument('--tokens', type=int, default=200, help="Text deltas per Bedrock stream")
+    parser.add_argument('--tokens-per-second', type=float, default=100.0)
+    parser.add_argument('--first-token-ms', type=float, default=300.0)
+    parser.add_argument('--token-text', default='lorem ')
+    parser.add_argument('--script', help="JSON file with a list of converse_stream events to replay instead")
+    parser.add_argument('--throttle-rps', type=float,
+                        help="Throttle Bedrock calls beyond this many per second")
+    parser.add_argument('--throttle-first', type=int, default=0, help="Throttle this many Bedrock calls first")
+    parser.add_argument('--throttle-in-stream', action='store_true',
+                        help="Raise throttles from the stream instead of the call")
+    parser.add_argument('--kb-latency-ms', type=float, default=150.0)
+    parser.add_argument('--post-latency-ms', type=float, default=20.0, help="Latency added to each post_to_connection")
+    parser.add_argument('--messages', type=int, default=100, help="Calls to websocket-send-message")
+    parser.add_argument('--message-chars', type=int, default=512)
+    parser.add_argument('--output', help="Write the JSON results here instead of stdout")
+    parser.add_argument('--baseline', help="Earlier results to compare against; exits 1 on regressions")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed p50 slowdown against the baseline")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_environment()
+    import clients
+    import throttle
+    import websocket
+
+    script = None
+    if args.script:
+        with open(args.script, encoding='utf-8') as f:
+            script = json.load(f)
+        args.tokens = sum(1 for event in script if 'contentBlockDelta' in event)
+
+    bedrock = fakes.FakeThrottlingBedrockRuntime(
+        requests_per_second=args.throttle_rps, throttle_first=args.throttle_first,
+        in_stream=args.throttle_in_stream, script=script, tokens=args.tokens,
+        tokens_per_second=args.tokens_per_second, first_token_ms=args.first_token_ms, token_text=args.token_text
+    )
+    kb = fakes.FakeKnowledgeBase(latency_ms=args.kb_latency_ms)
+    s3 = fakes.FakeS3()
+    gateway = fakes.FakeApiGateway(latency_ms=args.post_latency_ms)
+    clients.set_client('bedrock-runtime', bedrock)
+    clients.set_client('bedrock-agent-runtime', kb)
+    clients.set_client('s3', s3)
+    websocket.set_gateway_client(DOMAIN_NAME, gateway)
+
+    results = {
+        'config': {
+            'iterations': args.iterations,
+            'tokens': args.tokens,
+            'tokensPerSecond': args.tokens_per_second,
+            'firstTokenMs': args.first_token_ms,
+            'kbLatencyMs': args.kb_latency_ms,
+            'postLatencyMs': args.post_latency_ms,
+            'throttleRps': args.throttle_rps,
+            'throttleFirst': args.throttle_first,
+            'flushMaxChars': websocket.FLUSH_MAX_CHARS,
+            'flushIntervalMs': websocket.FLUSH_INTERVAL_MS,
+            'script': args.script
+        },
+        'scenarios': {
+            scenario: BENCHMARKS[scenario](args, bedrock, kb, s3, gateway)
+            for scenario in args.scenarios
+        }
+    }
+
+    results['throttling'] = {
+        'throttledCalls': bedrock.throttled,
+        'limiters': throttle.stats()
+    }
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            results['regressions'] = compare(results, json.load(f), args.tolerance)
+        exit_code = 1 if results['regressions'] else 0
+
+    body = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(body + '\n')
+    else:
+        print(body)
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
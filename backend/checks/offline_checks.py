@@ -0,0 +1,124 @@
+# Offline checks of shared layer modules against the repository's own
+# inputs. Nothing here calls AWS:
+#
+#   python checks/offline_checks.py
+#   python checks/offline_checks.py rubric batch
+#
+# Each check raises AssertionError on failure; the script exits non-zero
+# when any check fails.
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import traceback
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_DIR = os.path.dirname(BACKEND_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'lambda', 'shared'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+
+from botocore.exceptions import ClientError
+import batch
+import rubric
+
+
+def check_rubric():
+    """
+    The rubric in frontend/prompts.txt splits into its numbered sections,
+    with the instructions around the block kept whole as the preamble
+    """
+    with open(os.path.join(REPO_DIR, 'frontend', 'prompts.txt'), encoding='utf-8') as f:
+        prompt = f.read()
+
+    preamble, sections = rubric.parse_sections(prompt)
+    assert [section.number for section in sections] == [1, 2, 3, 4, 5], sections
+    assert sections[0].title == 'Overview'
+    assert sections[-1].criteria.endswith('architecture of the solution.')
+    assert 'mentioned in the <sections> tags' in preamble
+    assert preamble.endswith('adjust the rating accordingly.')
+
+    # A closed block gives the same sections, and text after it stays in the preamble
+    closed_preamble, closed_sections = rubric.parse_sections(prompt.rstrip() + '\n</sections>\nBe brief.')
+    assert closed_sections == sections
+    assert closed_preamble.endswith('Be brief.')
+
+
+def check_batch():
+    """
+    A batch read from a manifest runs end to end on LocalDocumentStore and
+    MemoryBatchTable: throttled documents are retried with a lower
+    concurrency limit, and a batch stopped part way resumes where it left off
+    """
+    with tempfile.TemporaryDirectory() as root:
+        documents = batch.LocalDocumentStore(root)
+        keys = [f'docs/report-{index}.pdf' for index in range(6)]
+        for key in keys:
+            documents.write(key, f'%PDF {key}')
+        documents.write('manifests/all.json', json.dumps(keys + [keys[0]]))
+
+        throttled = set()
+        lock = threading.Lock()
+
+        def evaluate(document_bytes, document_key, prompt, model_id):
+            # The first attempt at every other document is throttled
+            with lock:
+                first_attempt = document_key not in throttled
+                throttled.add(document_key)
+            if first_attempt and document_key.endswith(('0.pdf', '2.pdf', '4.pdf')):
+                raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Slow down'}}, 'Converse')
+            return f'{prompt}: {document_bytes.decode()}'
+
+        table = batch.MemoryBatchTable()
+        manifest_keys = batch.read_manifest(documents, 'manifests/all.json')
+        assert batch.create_batch(table, 'b1', manifest_keys, 'Rate it', 'offline-model') == keys
+        assert batch.get_progress(table, 'b1')['counts']['pending'] == 6
+
+        scheduler = batch.BatchScheduler(documents, table, evaluate, max_concurrency=2,
+                                         sleep=lambda seconds: None)
+        started = []
+        remaining = scheduler.run('b1', should_stop=lambda: started.append(1) or len(started) > 3)
+        assert remaining == 3, remaining
+        assert batch.get_progress(table, 'b1')['status'] == 'running'
+
+        # A second worker picks up the documents the first one did not start
+        assert scheduler.run('b1') == 0
+        progress = batch.get_progress(table, 'b1', include_documents=True)
+        assert progress['status'] == 'completed', progress
+        assert progress['counts']['completed'] == 6 and progress['percentComplete'] == 100.0, progress
+        assert scheduler.throttles == 3 and scheduler.limit <= 2
+        assert all(document['attempts'] == (2 if document['documentKey'].endswith(('0.pdf', '2.pdf', '4.pdf')) else 1)
+                   for document in progress['documents']), progress['documents']
+        assert documents.read(batch.result_key('b1', keys[1])).decode() == f'Rate it: %PDF {keys[1]}'
+        assert batch.get_progress(table, 'unknown') is None
+
+
+CHECKS = {
+    'batch': check_batch,
+    'rubric': check_rubric,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the offline checks')
+    parser.add_argument('checks', nargs='*', help=f"Checks to run, all by default: {', '.join(sorted(CHECKS))}")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.checks if name not in CHECKS]
+    if unknown:
+        parser.error(f"unknown checks: {', '.join(unknown)}")
+
+    failed = 0
+    for name in args.checks or sorted(CHECKS):
+        try:
+            CHECKS[name]()
+            print(f"ok      {name}")
+        except Exception:
+            failed += 1
+            print(f"FAILED  {name}")
+            traceback.print_exc()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
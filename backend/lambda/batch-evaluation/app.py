@@ -0,0 +1,199 @@
+import json
+import logging
+import os
+import uuid
+import batch
+import clients
+import response_cache
+import throttle
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Initialize clients once per container from the shared registry
+bedrock_runtime = clients.bedrock_runtime()
+lambda_client = clients.get_client('lambda')
+BUCKET_NAME = os.environ.get('BUCKET_NAME')
+
+# Model used when a batch does not name one
+MODEL_ID = os.environ.get('MODEL_ID', 'anthropic.claude-3-5-sonnet-20241022-v2:0')
+
+# Stop starting documents when less than this is left of the invocation and
+# continue the batch in a fresh one
+CONTINUE_MARGIN_MS = int(os.environ.get('BATCH_CONTINUE_MARGIN_MS', '120000'))
+
+# Converse document formats by file extension
+DOCUMENT_FORMATS = {
+    'pdf': 'pdf', 'csv': 'csv', 'doc': 'doc', 'docx': 'docx', 'xls': 'xls',
+    'xlsx': 'xlsx', 'html': 'html', 'txt': 'txt', 'md': 'md'
+}
+
+headers = {
+    'Content-Type': 'application/json',
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET,POST,OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type'
+}
+
+def evaluate_document(file_bytes, document_key, prompt, model_id):
+    """
+    Evaluate one document with the batch prompt and return the response text
+    """
+    inference_config = {
+        "maxTokens": 2000,
+        "temperature": 0
+    }
+    cache_key = response_cache.cache_key(
+        model_id,
+        inference_config,
+        prompt=prompt,
+        document=response_cache.document_hash(file_bytes)
+    )
+    cached_response = response_cache.get(cache_key)
+    if cached_response is not None:
+        return cached_response
+
+    extension = document_key.rsplit('.', 1)[-1].lower()
+    # Admission is rate limited per model; throttles are retried by the
+    # batch scheduler, which also lowers the batch concurrency
+    response = throttle.converse(
+        bedrock_runtime,
+        max_retries=0,
+        modelId=model_id,
+        messages=[{
+            "role": "user",
+            "content": [
+                {
+                    "document": {
+                        "name": "Document 1",
+                        "format": DOCUMENT_FORMATS.get(extension, 'pdf'),
+                        "source": {
+                            "bytes": file_bytes
+                        }
+                    }
+                },
+                { "text": "Based on the document, " + prompt }
+            ]
+        }],
+        inferenceConfig=inference_config,
+    )
+    text = response['output']['message']['content'][0]['text']
+    response_cache.put(cache_key, text, model_id=model_id)
+    return text
+
+def start_batch(request_body, function_name):
+    """
+    Create a batch from an S3 prefix or manifest and start its worker
+    """
+    prompt = request_body.get('prompt')
+    prefix = request_body.get('prefix')
+    manifest_key = request_body.get('manifestKey')
+    if not prompt or not (prefix or manifest_key or request_body.get('keys')):
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': 'prompt and one of prefix, manifestKey or keys are required'})
+        }
+
+    documents = batch.S3DocumentStore(BUCKET_NAME)
+    if request_body.get('keys'):
+        document_keys = request_body['keys']
+    elif manifest_key:
+        document_keys = batch.read_manifest(documents, manifest_key)
+    else:
+        document_keys = documents.list_keys(prefix)
+    if not document_keys:
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': 'No documents found'})
+        }
+
+    batch_id = str(uuid.uuid4())
+    model_id = request_body.get('modelId') or MODEL_ID
+    document_keys = batch.create_batch(batch.DynamoDBBatchTable(), batch_id, document_keys, prompt, model_id,
+                                       prefix=prefix or manifest_key or '')
+    continue_batch(batch_id, function_name)
+
+    return {
+        'statusCode': 202,
+        'headers': headers,
+        'body': json.dumps({'message': 'ok', 'batchId': batch_id, 'total': len(document_keys)})
+    }
+
+def continue_batch(batch_id, function_name):
+    lambda_client.invoke(
+        FunctionName=function_name,
+        InvocationType='Event',
+        Payload=json.dumps({'action': 'runBatch', 'batchId': batch_id})
+    )
+
+def run_batch(batch_id, context):
+    """
+    Worker: evaluate the batch's pending documents, handing the rest over to
+    a new invocation before this one times out
+    """
+    scheduler = batch.BatchScheduler(
+        batch.S3DocumentStore(BUCKET_NAME),
+        batch.DynamoDBBatchTable(),
+        evaluate_document
+    )
+    remaining = scheduler.run(
+        batch_id,
+        should_stop=lambda: context.get_remaining_time_in_millis() < CONTINUE_MARGIN_MS
+    )
+    logger.info(f"Batch {batch_id}: {remaining} documents remaining, {scheduler.throttles} throttles")
+    if remaining:
+        continue_batch(batch_id, context.function_name)
+    return {'batchId': batch_id, 'remaining': remaining}
+
+def lambda_handler(event, context):
+
+    if event.get('action') == 'runBatch':
+        return run_batch(event['batchId'], context)
+
+    if event.get('httpMethod') == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': ''
+        }
+
+    try:
+        if event.get('httpMethod') == 'POST':
+            return start_batch(json.loads(event.get('body') or '{}'), context.function_name)
+
+        params = event.get('queryStringParameters') or {}
+        batch_id = params.get('batchId')
+        if not batch_id:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': 'batchId is required'})
+            }
+
+        progress = batch.get_progress(
+            batch.DynamoDBBatchTable(),
+            batch_id,
+            include_documents=params.get('documents', '').lower() in ('1', 'true', 'yes')
+        )
+        if progress is None:
+            return {
+                'statusCode': 404,
+                'headers': headers,
+                'body': json.dumps({'error': f'Batch {batch_id} not found'})
+            }
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': json.dumps(progress, default=int)
+        }
+
+    except Exception as e:
+        logger.error(f"Unhandled exception: {str(e)}")
+        return {
+            'statusCode': 500,
+            'headers': headers,
+            'body': json.dumps({'error': f'An unexpected error occurred: {str(e)}'})
+        }
@@ -1,23 +1,18 @@
+import coldstart
 import os
 import json
-import boto3
+import clients
+import jobs
+import metrics
+import prompt_cache
+import response_cache
+import retrieval_cache
+import throttle
 import websocket
 from aws_lambda_powertools import Logger
-from langchain.prompts import ChatPromptTemplate
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationalRetrievalChain
-from langchain_community.chat_message_histories import DynamoDBChatMessageHistory
-from langchain_aws.chat_models import ChatBedrock
-from langchain_aws.embeddings import BedrockEmbeddings
-from langchain.retrievers.bedrock import AmazonKnowledgeBasesRetriever
-from langchain.llms.bedrock import Bedrock
-from langchain.schema.runnable import RunnablePassthrough
-from langchain.schema.output_parser import StrOutputParser
 
 MODEL_ID = os.environ["MODEL_ID"]
 EMBEDDING_MODEL_ID = os.environ["EMBEDDING_MODEL_ID"]
-lambda_client = boto3.client('lambda')
-s3 = boto3.client("s3")
 logger = Logger()
 
 headers = {
@@ -29,41 +24,55 @@ headers = {
 
 def send_websocket_message(connection_id, domain_name, message):
     """
-    Send a message to a WebSocket client using the websocket-send-message Lambda function
+    Send a message to a WebSocket client using the shared sender and return
+    its status response
     """
     try:
-        websocket.send_websocket_message(connection_id, domain_name, message)
-        return True
+        return websocket.send_websocket_message(connection_id, domain_name, message)
     except Exception as e:
         logger.error(f"Error sending WebSocket message: {str(e)}")
-        return False
+        return {'statusCode': 500, 'body': json.dumps({'error': str(e)})}
     
 
-def bedrock_chain(bedrock_kb_id, connection_id, domain_name, prompt_template, human_input, bedrock_runtime):
+def bedrock_chain(bedrock_kb_id, connection_id, domain_name, prompt_template, human_input, bedrock_runtime, job_id=None,
+                  bypass_cache=False):
     print('prompt_template', prompt_template)
     print('human_input', human_input)
 
-    # Initialize boto3 client for Bedrock Runtime and Knowledge Bases
-    bedrock_runtime_client = boto3.client('bedrock-runtime', region_name="us-west-2")
-    bedrock_kb_client = boto3.client('bedrock-agent-runtime')
-
-    # Get context from Knowledge Base using boto3
-    kb_response = bedrock_kb_client.retrieve(
-        knowledgeBaseId=bedrock_kb_id,
-        retrievalQuery={
-            'text': human_input
-        },
-        retrievalConfiguration={
-            "vectorSearchConfiguration": {
-                "numberOfResults": 1
-            }
-        }
-    )
+    # Bedrock Runtime and Knowledge Base clients are shared across warm invocations
+    bedrock_runtime_client = bedrock_runtime
+    bedrock_kb_client = clients.bedrock_agent_runtime()
+
+    # Timings and token usage of this request, emitted as CloudWatch EMF
+    request_metrics = metrics.RequestMetrics('generate-text-response', MODEL_ID, jobId=job_id)
+    try:
+        return stream_response(bedrock_kb_id, connection_id, domain_name, prompt_template, human_input,
+                               bedrock_runtime_client, bedrock_kb_client, job_id, bypass_cache, request_metrics)
+    finally:
+        request_metrics.emit()
+
+
+def stream_response(bedrock_kb_id, connection_id, domain_name, prompt_template, human_input,
+                    bedrock_runtime_client, bedrock_kb_client, job_id, bypass_cache, request_metrics):
+    # Get context from Knowledge Base, reusing recent results for the same query
+    with request_metrics.timer('KnowledgeBaseLatency'):
+        retrieval_results = retrieval_cache.retrieve(
+            bedrock_kb_client,
+            bedrock_kb_id,
+            human_input,
+            {
+                "vectorSearchConfiguration": {
+                    "numberOfResults": 1
+                }
+            },
+            bypass=bypass_cache
+        )
+    logger.info(f"Retrieval cache stats: {retrieval_cache.stats()}")
 
     # Extract and join the context from the retrieved documents
     context = "\n".join(
         result['content']['text'] 
-        for result in kb_response['retrievalResults']
+        for result in retrieval_results
     )
 
     # Format the prompt with context and question
@@ -88,80 +97,101 @@ def bedrock_chain(bedrock_kb_id, connection_id, domain_name, prompt_template, hu
     #     body=json.dumps(request_body)
     # )
 
-    # Format the prompt with context and question
-    formatted_prompt = prompt_template.format(context=context, question=human_input)
+    # Format the prompt with context and question, keeping the static
+    # instructions before the first placeholder apart so they can be cached
+    static_prompt, dynamic_prompt = prompt_cache.split_template(
+        prompt_template,
+        context=context,
+        question=human_input
+    )
 
     # Prepare the message for Claude 3
     message = {
-        "content": [{"text": formatted_prompt}],
+        "content": prompt_cache.content(
+            MODEL_ID,
+            [{"text": static_prompt}] if static_prompt else [],
+            [{"text": dynamic_prompt}] if dynamic_prompt else []
+        ),
         "role": "user"
     }
 
-    response = bedrock_runtime_client.converse_stream(
-        modelId=MODEL_ID,
-        messages=[message],
-        inferenceConfig= {
-            'maxTokens': 120000,
-            'temperature': 0.0
-        }
-    )
-
-    
-
-    full_response = ""
-    # Process the streaming response
-    for event in response['stream']:
-        # Handle different event types
-        if 'contentBlockDelta' in event:
-            if 'delta' in event['contentBlockDelta']:
-                delta = event['contentBlockDelta']['delta']
-                if 'text' in delta:
-                    text_chunk = delta['text']
-                    full_response += text_chunk
-                    
-                    if connection_id:
-                        send_websocket_message(
-                            connection_id,
-                            domain_name,
-                            {'chunk': text_chunk, 'done': False}
-                        )
-
-    response = bedrock_runtime_client.converse_stream(
-    modelId=MODEL_ID,
-    messages=[message],
-    inferenceConfig={
+    inference_config = {
         'maxTokens': 120000,
         'temperature': 0.0
     }
-)
-
-                    
-    # full_response = ""
-    # # Process the streaming response
-    # for event in response['body']:
-    #     chunk = json.loads(event['chunk']['bytes'].decode())
-    #     if 'completion' in chunk:
-    #         text_chunk = chunk['completion']
-    #         full_response += text_chunk
-            
-    #         if connection_id:
-    #             send_websocket_message(
-    #                 connection_id,
-    #                 domain_name,
-    #                 {'chunk': text_chunk, 'done': False}
-    #             )
-
-                
-    # Send final message indicating completion
-    send_websocket_message(
+
+    # Deliver streamed tokens as batched, sequenced WebSocket frames from a
+    # background thread so the stream is never blocked on API Gateway
+    coalescer = websocket.BackgroundStreamSender(
         connection_id,
         domain_name,
-        {'chunk': '', 'done': True, 'fullResponse': full_response}
+        send=send_websocket_message,
+        metrics=request_metrics,
+        job_id=job_id
+    )
+
+    # Temperature 0 evaluations are deterministic, replay a previous answer
+    cache_key = response_cache.cache_key(
+        MODEL_ID,
+        inference_config,
+        prompt_template=prompt_template,
+        context=context,
+        question=human_input
     )
+
+    try:
+        cached_response = None if bypass_cache else response_cache.get(cache_key)
+        if cached_response is not None:
+            request_metrics.properties['cached'] = True
+            full_response = response_cache.replay(coalescer, cached_response)
+            jobs.record_job_status(job_id, 'completed', chars=len(full_response), cached=True)
+            return full_response
+
+        # Admission is rate limited per model, and throttles are retried until
+        # the first token arrives
+        request_metrics.stream_started()
+        response = throttle.converse_stream(
+            bedrock_runtime_client,
+            metrics=request_metrics,
+            modelId=MODEL_ID,
+            messages=[message],
+            inferenceConfig=inference_config
+        )
+
+        # Process the streaming response
+        for event in response['stream']:
+            request_metrics.stream_event(event)
+
+            # Handle different event types
+            if 'contentBlockDelta' in event:
+                if 'delta' in event['contentBlockDelta']:
+                    delta = event['contentBlockDelta']['delta']
+                    if 'text' in delta:
+                        coalescer.add(delta['text'])
+
+            # Stop paying for tokens nobody will read once the client is gone
+            if coalescer.disconnected:
+                response['stream'].close()
+                jobs.record_job_status(job_id, 'cancelled', chars=len(coalescer.full_response))
+                raise websocket.ClientDisconnected(connection_id)
+    except websocket.ClientDisconnected:
+        coalescer.abort()
+        raise
+    except Exception as e:
+        # Stop the sender thread and tell the client the evaluation failed
+        coalescer.fail(str(e))
+        raise
+
+    # Flush remaining text and send final message indicating completion
+    full_response = coalescer.close()
+    logger.info(f"Streamed response in {coalescer.frames_sent} WebSocket frames")
+    response_cache.put(cache_key, full_response, model_id=MODEL_ID)
+    jobs.record_job_status(job_id, 'completed', chars=len(full_response))
     return full_response
 
 
 def lambda_handler(event, context):
+    coldstart.report()
     print(event)
     
     # Check if this is a WebSocket request (has connectionId)
@@ -174,19 +204,50 @@ def lambda_handler(event, context):
             'headers': headers,
             'body': ''
         }
+
+    # Drop cached retrieval results after a Knowledge Base re-sync
+    if event.get('action') == 'invalidateRetrievalCache':
+        bedrock_kb_id = event.get('bedrockKBID')
+        if not bedrock_kb_id:
+            return {
+                "statusCode": 400,
+                "headers": headers,
+                "body": json.dumps({'error': 'Missing bedrockKBID'}),
+            }
+        removed = retrieval_cache.invalidate(bedrock_kb_id)
+        return {
+            "statusCode": 200,
+            "headers": headers,
+            "body": json.dumps({'invalidated': bedrock_kb_id, 'localEntries': removed}),
+        }
     
     connection_id = event.get('connectionId')
     domain_name = event.get('domainName')
     bedrock_kb_id = event.get('bedrockKBID')
     human_input = event.get('prompt')
     prompt_template = event.get('prompt_template')
+    job_id = event.get('jobId') or getattr(context, 'aws_request_id', None)
+    bypass_cache = bool(event.get('bypassCache'))
     
-    bedrock_runtime = boto3.client(
-        service_name="bedrock-runtime",
-        region_name="us-west-2",
-    )
+    bedrock_runtime = clients.bedrock_runtime()
 
-    response = bedrock_chain(bedrock_kb_id, connection_id, domain_name, prompt_template, human_input, bedrock_runtime)
+    jobs.record_job_status(job_id, 'running', connectionId=connection_id)
+    try:
+        response = bedrock_chain(bedrock_kb_id, connection_id, domain_name, prompt_template, human_input, bedrock_runtime, job_id,
+                                bypass_cache=bypass_cache)
+    except websocket.ClientDisconnected:
+        logger.info(f"Client {connection_id} disconnected, job {job_id} cancelled")
+        return {
+            "statusCode": 200,
+            "headers": headers,
+            "body": json.dumps({'jobId': job_id, 'status': 'cancelled'}),
+        }
+    except Exception as e:
+        jobs.record_job_status(job_id, 'failed', error=str(e))
+        raise
+    finally:
+        # Later identical requests start a new job, or hit the response cache
+        jobs.release_flight(event.get('flightKey'), job_id)
     if response:
         print('human_input', human_input)
         print('response', response)
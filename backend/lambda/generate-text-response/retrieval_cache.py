@@ -0,0 +1,106 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import cache
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Retrieval results are cached per warm container and, when CACHE_TABLE_NAME
+# is set, in DynamoDB so every container can reuse them
+RETRIEVAL_CACHE_ENABLED = os.environ.get('RETRIEVAL_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+RETRIEVAL_CACHE_SIZE = int(os.environ.get('RETRIEVAL_CACHE_SIZE', '256'))
+RETRIEVAL_CACHE_TTL_SECONDS = int(os.environ.get('RETRIEVAL_CACHE_TTL_SECONDS', '300'))
+RETRIEVAL_SHARED_CACHE_TTL_SECONDS = int(os.environ.get('RETRIEVAL_SHARED_CACHE_TTL_SECONDS', '3600'))
+
+_memory = cache.TTLCache(RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL_SECONDS)
+_shared = cache.DynamoDBCache(ttl_seconds=RETRIEVAL_SHARED_CACHE_TTL_SECONDS)
+_stats_lock = threading.Lock()
+_stats = {'memoryHits': 0, 'sharedHits': 0, 'misses': 0, 'latencySavedMs': 0.0}
+
+def _cache_key(kb_id, query, retrieval_configuration):
+    digest = hashlib.sha256(json.dumps(
+        {'query': query, 'retrievalConfiguration': retrieval_configuration},
+        sort_keys=True
+    ).encode('utf-8')).hexdigest()
+    return f'kb#{kb_id}#{digest}'
+
+def _invalidation_key(kb_id):
+    return f'kb#{kb_id}#invalidated'
+
+def _record(stat, saved_ms=0.0):
+    with _stats_lock:
+        _stats[stat] += 1
+        _stats['latencySavedMs'] += saved_ms
+
+def retrieve(kb_client, kb_id, query, retrieval_configuration, bypass=False):
+    """
+    Return the retrievalResults for a Knowledge Base query, serving them from
+    the cache when the same KB, query and configuration were retrieved
+    recently
+    """
+    if not RETRIEVAL_CACHE_ENABLED or bypass:
+        return _retrieve(kb_client, kb_id, query, retrieval_configuration)[0]
+
+    key = _cache_key(kb_id, query, retrieval_configuration)
+    entry = _memory.get(key)
+    if entry is not None:
+        _record('memoryHits', entry['latencyMs'])
+        return entry['results']
+
+    items = _shared.get_many([key, _invalidation_key(kb_id)])
+    item = items.get(key)
+    marker = items.get(_invalidation_key(kb_id))
+    if item is not None and (marker is None or item['createdAt'] > marker['value']['invalidatedAt']):
+        entry = item['value']
+        _memory.put(key, entry)
+        _record('sharedHits', entry['latencyMs'])
+        return entry['results']
+
+    results, latency_ms = _retrieve(kb_client, kb_id, query, retrieval_configuration)
+    entry = {'results': results, 'latencyMs': latency_ms}
+    _memory.put(key, entry)
+    _shared.put(key, entry, kbId=kb_id)
+    _record('misses')
+    return results
+
+def _retrieve(kb_client, kb_id, query, retrieval_configuration):
+    start = time.perf_counter()
+    kb_response = kb_client.retrieve(
+        knowledgeBaseId=kb_id,
+        retrievalQuery={
+            'text': query
+        },
+        retrievalConfiguration=retrieval_configuration
+    )
+    latency_ms = round((time.perf_counter() - start) * 1000, 1)
+    return kb_response['retrievalResults'], latency_ms
+
+def invalidate(kb_id):
+    """
+    Drop cached results for a Knowledge Base, e.g. after it was re-synced.
+    Other warm containers keep their in-memory entries until
+    RETRIEVAL_CACHE_TTL_SECONDS passes.
+    """
+    prefix = f'kb#{kb_id}#'
+    removed = _memory.invalidate(lambda key: key.startswith(prefix))
+    _shared.put(
+        _invalidation_key(kb_id),
+        {'invalidatedAt': int(time.time() * 1000)},
+        kbId=kb_id
+    )
+    logger.info(f"Invalidated retrieval cache for KB {kb_id}, {removed} local entries removed")
+    return removed
+
+def stats():
+    """
+    Return hit/miss counters and the retrieval latency saved by cache hits
+    """
+    with _stats_lock:
+        result = dict(_stats)
+    result['memory'] = _memory.stats()
+    return result
@@ -1,16 +1,117 @@
+import base64
+import hashlib
 import json
-import boto3
+import clients
 from boto3.dynamodb.conditions import Key
 
-dynamodb = boto3.resource('dynamodb')
+dynamodb = clients.get_resource('dynamodb')
 table = dynamodb.Table('healthcare-demo-prompts')
 headers = {
     'Content-Type': 'application/json',
     'Access-Control-Allow-Origin': '*',
     'Access-Control-Allow-Methods': 'GET,POST,OPTIONS',
-    'Access-Control-Allow-Headers': 'Content-Type'
+    'Access-Control-Allow-Headers': 'Content-Type,If-None-Match'
 }
 
+# Counter bumped on every write, used to build ETags for the prompt list.
+# It lives in a partition of its own so prompt queries and pages never
+# see it; the title it used to be stored under stays reserved.
+VERSION_PARTITION_SUFFIX = '#meta'
+VERSION_TITLE = '#version'
+
+# Attributes returned for ?fields=titles
+TITLE_FIELDS = ['demo', 'title']
+
+def get_version(demo):
+    """
+    Read the prompt list version for a demo
+    """
+    response = table.get_item(
+        Key={'demo': demo + VERSION_PARTITION_SUFFIX, 'title': VERSION_TITLE},
+        ProjectionExpression='version'
+    )
+    return int(response.get('Item', {}).get('version', 0))
+
+def bump_version(demo):
+    table.update_item(
+        Key={'demo': demo + VERSION_PARTITION_SUFFIX, 'title': VERSION_TITLE},
+        UpdateExpression='ADD version :one',
+        ExpressionAttributeValues={':one': 1}
+    )
+
+def build_etag(demo, version, params):
+    """
+    ETag for one representation of the prompt list: the demo version plus
+    the paging and projection parameters
+    """
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+    return f'"{demo}-{version}-{digest}"'
+
+def encode_token(last_evaluated_key):
+    return base64.urlsafe_b64encode(json.dumps(last_evaluated_key).encode('utf-8')).decode('utf-8')
+
+def decode_token(token):
+    """
+    Decode a nextToken, raising ValueError when it is not one of ours
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token.encode('utf-8')))
+    except Exception:
+        raise ValueError('Invalid nextToken')
+    if not isinstance(key, dict):
+        raise ValueError('Invalid nextToken')
+    return key
+
+def parse_limit(value):
+    """
+    Parse the limit parameter, raising ValueError unless it is a positive integer
+    """
+    if not value:
+        return None
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError('limit must be a positive integer')
+    if limit < 1:
+        raise ValueError('limit must be a positive integer')
+    return limit
+
+def bad_request(message):
+    return {
+        'statusCode': 400,
+        'headers': headers,
+        'body': json.dumps({'error': message})
+    }
+
+def query_prompts(demo, fields, limit=None, start_key=None):
+    """
+    Query the prompts for a demo, from the decoded start_key of a nextToken.
+    With a limit, return one page and the token for the next one; otherwise
+    page through every result.
+    """
+    query_kwargs = {
+        'KeyConditionExpression': Key('demo').eq(demo)
+    }
+    if fields == 'titles':
+        query_kwargs['ProjectionExpression'] = ', '.join(f'#{name}' for name in TITLE_FIELDS)
+        query_kwargs['ExpressionAttributeNames'] = {f'#{name}': name for name in TITLE_FIELDS}
+    if limit:
+        query_kwargs['Limit'] = limit
+    if start_key:
+        query_kwargs['ExclusiveStartKey'] = start_key
+
+    items = []
+    while True:
+        response = table.query(**query_kwargs)
+        items.extend(response['Items'])
+        last_evaluated_key = response.get('LastEvaluatedKey')
+        if limit or not last_evaluated_key:
+            break
+        query_kwargs['ExclusiveStartKey'] = last_evaluated_key
+
+    token = encode_token(last_evaluated_key) if limit and last_evaluated_key else None
+    return items, token
+
 def lambda_handler(event, context):
 
     if event.get('httpMethod') == 'OPTIONS':
@@ -26,6 +127,8 @@ def lambda_handler(event, context):
         if http_method == 'POST':
             # Save new prompt
             body = json.loads(event['body'])
+            if body['title'] == VERSION_TITLE or body['demo'].endswith(VERSION_PARTITION_SUFFIX):
+                return bad_request(f"Title '{VERSION_TITLE}' and demos ending in '{VERSION_PARTITION_SUFFIX}' are reserved")
             item = {
                 'demo': body['demo'],
                 'title': body['title'],
@@ -36,6 +139,7 @@ def lambda_handler(event, context):
                 item['prompt_template'] = body['prompt_template']
                 
             table.put_item(Item=item)
+            bump_version(body['demo'])
             return {
                 'statusCode': 200,
                 'headers': {
@@ -47,19 +151,47 @@ def lambda_handler(event, context):
             
         elif http_method == 'GET':
             # Get prompts for a demo
-            demo = event['queryStringParameters'].get('demo')
-            response = table.query(
-                KeyConditionExpression=Key('demo').eq(demo)
-            )
-            items = response['Items']
+            params = event.get('queryStringParameters') or {}
+            demo = params.get('demo')
+            fields = params.get('fields', 'full')
+            next_token = params.get('nextToken')
+            try:
+                limit = parse_limit(params.get('limit'))
+                start_key = decode_token(next_token) if next_token else None
+            except ValueError as e:
+                return bad_request(str(e))
+
+            # Unchanged prompt lists are answered from the version counter alone
+            etag = build_etag(demo, get_version(demo), {
+                'fields': fields,
+                'limit': limit,
+                'nextToken': next_token
+            })
+            response_headers = {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Expose-Headers': 'ETag',
+                'Cache-Control': 'no-cache',
+                'ETag': etag
+            }
+            request_headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+            if request_headers.get('if-none-match') == etag:
+                return {
+                    'statusCode': 304,
+                    'headers': response_headers,
+                    'body': ''
+                }
+
+            items, token = query_prompts(demo, fields, limit, start_key)
+
+            # Paged requests get the cursor alongside the items; the plain
+            # list is kept for callers that want everything
+            body = {'items': items, 'nextToken': token} if limit else items
             
             return {
                 'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps(items)
+                'headers': response_headers,
+                'body': json.dumps(body)
             }
             
     except Exception as e:
@@ -1,22 +1,33 @@
 import json
 import logging
 import base64
-import boto3
 import os
+import clients
+import documents
+import jobs
+import metrics
+import prompt_cache
+import response_cache
+import rubric
+import throttle
+import websocket
 from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Initialize Bedrock client
-bedrock_runtime = boto3.client('bedrock-runtime', 'us-west-2')
-lambda_client = boto3.client('lambda')
-s3_client = boto3.client('s3')
+# Initialize clients once per container from the shared registry
+bedrock_runtime = clients.bedrock_runtime()
+s3_client = clients.get_client('s3')
 BUCKET_NAME = os.environ['BUCKET_NAME']
 
 # Default model to use
 MODEL_ID = "anthropic.claude-3-5-sonnet-20241022-v2:0"
+
+# Rubric sections evaluated in parallel in 'sections' evaluation mode
+SECTION_MAX_WORKERS = int(os.environ.get('SECTION_MAX_WORKERS', '4'))
 headers = {
     'Content-Type': 'application/json',
     'Access-Control-Allow-Origin': '*',
@@ -26,25 +37,68 @@ headers = {
 
 def send_websocket_message(connection_id, domain_name, message):
     """
-    Send a message to a WebSocket client using the websocket-send-message Lambda function
+    Send a message to a WebSocket client using the shared in-process sender
+    and return its status response
     """
     try:
-        payload = {
-            'connectionId': connection_id,
-            'domainName': domain_name,
-            'message': message
-        }
-        
-        lambda_client.invoke(
-            FunctionName=os.environ.get('WEBSOCKET_SEND_MESSAGE_FUNCTION'),
-            InvocationType='RequestResponse',
-            Payload=json.dumps(payload)
-        )
-        
-        return True
+        return websocket.send_websocket_message(connection_id, domain_name, message)
     except Exception as e:
         logger.error(f"Error sending WebSocket message: {str(e)}")
-        return False
+        return {'statusCode': 500, 'body': json.dumps({'error': str(e)})}
+
+def evaluate_section(preamble, section, inference_config, request_metrics=None):
+    """
+    Evaluate a single rubric section and return its rated result
+    """
+    # The preamble is the same for every section, so it is the cached prefix
+    shared_prompt, section_instructions = rubric.section_prompt_parts(preamble, section)
+    response = throttle.converse(
+        bedrock_runtime,
+        metrics=request_metrics,
+        modelId=MODEL_ID,
+        messages=[{
+            "role": "user",
+            "content": prompt_cache.content(
+                MODEL_ID,
+                [{ "text": "Based on the document, " + shared_prompt }],
+                [{ "text": section_instructions }]
+            )
+        }],
+        inferenceConfig=inference_config,
+    )
+    if request_metrics is not None:
+        request_metrics.usage(response.get('usage', {}), response.get('metrics', {}).get('latencyMs'))
+    text = response['output']['message']['content'][0]['text']
+    return rubric.SectionResult(section, rubric.parse_rating(text), text)
+
+def evaluate_sections(preamble, sections, inference_config, sender, request_metrics=None):
+    """
+    Evaluate rubric sections concurrently, sending each one to the client as
+    soon as it finishes. Returns the report in section order with the
+    aggregated overall rating, or None if the client disconnected.
+    """
+    results = []
+    pool = ThreadPoolExecutor(max_workers=min(SECTION_MAX_WORKERS, len(sections)))
+    try:
+        futures = [
+            pool.submit(evaluate_section, preamble, section, inference_config, request_metrics)
+            for section in sections
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            sender.add(rubric.format_section(result))
+            if sender.disconnected:
+                return None
+    finally:
+        # Queued sections are cancelled and the handler does not wait for the
+        # calls in flight once the client is gone or a section failed
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    overall = rubric.format_overall(results)
+    sender.add(overall)
+    ordered = sorted(results, key=lambda result: result.section.number)
+    return ''.join(rubric.format_section(result) for result in ordered) + overall
 
 def lambda_handler(event, context):
     """
@@ -58,6 +112,8 @@ def lambda_handler(event, context):
     is_websocket = False
     connection_id = None
     domain_name = None
+    job_id = event.get('jobId') or getattr(context, 'aws_request_id', None)
+    flight_key = event.get('flightKey')
     
     if 'connectionId' in event:
         is_websocket = True
@@ -74,6 +130,9 @@ def lambda_handler(event, context):
             'body': ''
         }
 
+    # Timings and token usage of this request, emitted as CloudWatch EMF
+    request_metrics = metrics.RequestMetrics('process-image-bedrock', MODEL_ID, jobId=job_id)
+
     try:
         logger.info("Processing incoming request")
         prompt = event.get('prompt')
@@ -85,39 +144,116 @@ def lambda_handler(event, context):
                 'body': json.dumps({'error': 'Missing s3FileKey'})
             }
 
-        # Download file from S3
-        response = s3_client.get_object(
-            Bucket=BUCKET_NAME,
-            Key=s3FileKey
-        )
-        file_bytes = response['Body'].read()
+        # The document id (content hash) comes from the key, the intake step or
+        # object metadata; the bytes are only fetched if the model call needs them
+        document = documents.Document(BUCKET_NAME, s3FileKey, event.get('documentId'), s3=s3_client)
+        with request_metrics.timer('DocumentReadLatency'):
+            document_id = document.id
+        request_metrics.properties['documentId'] = document_id
 
+        # The rubric prompt is the static, cacheable prefix; per-document
+        # content goes after the cache point
         doc_message = {
             "role": "user",
-            "content": [
-                # {
-                #     "document": {
-                #         "name": "Document 1",
-                #         "format": "pdf",
-                #         "source": {
-                #             "bytes": file_bytes
-                #         }
-                #     }
-                # },
-                { "text": "Based on the document, " + prompt }
-            ]
+            "content": prompt_cache.content(
+                MODEL_ID,
+                [{ "text": "Based on the document, " + prompt }],
+                [
+                    # {
+                    #     "document": {
+                    #         "name": "Document 1",
+                    #         "format": "pdf",
+                    #         "source": {
+                    #             "bytes": document.content
+                    #         }
+                    #     }
+                    # },
+                ]
+            )
         }
         
+        inference_config = {
+            "maxTokens": 2000,
+            "temperature": 0
+        }
+
+        # Evaluate rubric sections in parallel when asked to and the prompt has them
+        preamble, sections = rubric.parse_sections(prompt)
+        by_section = event.get('evaluationMode') == 'sections' and len(sections) > 0
+
+        # Temperature 0 evaluations are deterministic, replay a previous answer
+        cache_key = response_cache.cache_key(
+            MODEL_ID,
+            inference_config,
+            prompt=prompt,
+            document=document_id,
+            mode='sections' if by_section else None
+        )
+        cached_response = None if event.get('bypassCache') else response_cache.get(cache_key)
+        if cached_response is not None:
+            request_metrics.properties['cached'] = True
+            if is_websocket:
+                coalescer = websocket.BackgroundStreamSender(
+                    connection_id,
+                    domain_name,
+                    send=send_websocket_message,
+                    metrics=request_metrics,
+                    job_id=job_id
+                )
+                response_cache.replay(coalescer, cached_response)
+                jobs.record_job_status(job_id, 'completed', chars=len(cached_response), cached=True)
+            return {
+                'statusCode': 200,
+                'headers': headers,
+                'body': json.dumps({'response': cached_response}),
+                'isBase64Encoded': False
+            }
+        
+        if by_section:
+            sender = websocket.BackgroundStreamSender(
+                connection_id if is_websocket else None,
+                domain_name,
+                send=send_websocket_message,
+                metrics=request_metrics,
+                job_id=job_id
+            )
+            jobs.record_job_status(job_id, 'running', connectionId=connection_id, sections=len(sections))
+            try:
+                report = evaluate_sections(preamble, sections, inference_config, sender, request_metrics)
+            except Exception as e:
+                sender.fail(str(e))
+                raise
+            if report is None:
+                sender.abort()
+                jobs.record_job_status(job_id, 'cancelled', chars=len(sender.full_response))
+                return {
+                    'statusCode': 200,
+                    'headers': headers,
+                    'body': json.dumps({'jobId': job_id, 'status': 'cancelled'}),
+                    'isBase64Encoded': False
+                }
+
+            # The final frame carries the report in section order
+            sender.close(fullResponse=report)
+            response_cache.put(cache_key, report, model_id=MODEL_ID)
+            jobs.record_job_status(job_id, 'completed', chars=len(report))
+            return {
+                'statusCode': 200,
+                'headers': headers,
+                'body': json.dumps({'response': report}),
+                'isBase64Encoded': False
+            }
+        
         # Invoke Bedrock with streaming
         try:
             # Invoke Bedrock with streaming
-            response_stream = bedrock_runtime.converse_stream(
+            request_metrics.stream_started()
+            response_stream = throttle.converse_stream(
+                bedrock_runtime,
+                metrics=request_metrics,
                 modelId=MODEL_ID,
                 messages=[doc_message],
-                inferenceConfig={
-                    "maxTokens": 2000,
-                    "temperature": 0
-                },
+                inferenceConfig=inference_config,
             )
             
             # Set headers for streaming response
@@ -129,25 +265,45 @@ def lambda_handler(event, context):
             
             # Process the streaming response chunks as they arrive
             if is_websocket:
-                # For WebSocket requests, send each chunk as it arrives
-                full_response = ""
-
-                for chunk in response_stream["stream"]:
-                    if "contentBlockDelta" in chunk:
-                        text_chunk = chunk["contentBlockDelta"]["delta"]["text"]
-                        full_response += text_chunk
-                        send_websocket_message(
-                                    connection_id,
-                                    domain_name,
-                                    {'chunk': text_chunk, 'done': False}
-                                )
-                
-                # Send final message indicating completion
-                send_websocket_message(
+                # For WebSocket requests, send chunks as batched, sequenced frames
+                # from a background thread while the stream is being read
+                coalescer = websocket.BackgroundStreamSender(
                     connection_id,
                     domain_name,
-                    {'chunk': '', 'done': True, 'fullResponse': full_response}
+                    send=send_websocket_message,
+                    metrics=request_metrics,
+                    job_id=job_id
                 )
+
+                jobs.record_job_status(job_id, 'running', connectionId=connection_id)
+                try:
+                    for chunk in response_stream["stream"]:
+                        request_metrics.stream_event(chunk)
+                        if "contentBlockDelta" in chunk:
+                            coalescer.add(chunk["contentBlockDelta"]["delta"]["text"])
+
+                        # Stop reading the model output once the client is gone
+                        if coalescer.disconnected:
+                            break
+                except Exception as e:
+                    coalescer.fail(str(e))
+                    raise
+
+                if coalescer.disconnected:
+                    coalescer.abort()
+                    response_stream["stream"].close()
+                    jobs.record_job_status(job_id, 'cancelled', chars=len(coalescer.full_response))
+                    return {
+                        'statusCode': 200,
+                        'headers': headers,
+                        'body': json.dumps({'jobId': job_id, 'status': 'cancelled'}),
+                        'isBase64Encoded': False
+                    }
+                
+                # Flush remaining text and send final message indicating completion
+                full_response = coalescer.close()
+                response_cache.put(cache_key, full_response, model_id=MODEL_ID)
+                jobs.record_job_status(job_id, 'completed', chars=len(full_response))
                 
                 # Return success response (though it's not used by client)
                 return {
@@ -159,9 +315,9 @@ def lambda_handler(event, context):
             else:
                 # For REST API requests, collect all chunks and return as a single response
                 full_response = ""
-                for event in response_stream:
-                    if 'chunk' in event:
-                        chunk = event['chunk']
+                for stream_event in response_stream:
+                    if 'chunk' in stream_event:
+                        chunk = stream_event['chunk']
                         if 'message' in chunk and 'content' in chunk['message']:
                             content = chunk['message']['content']
                             if content and len(content) > 0 and 'text' in content[0]:
@@ -177,6 +333,7 @@ def lambda_handler(event, context):
                 }
 
         except Exception as e:
+            jobs.record_job_status(job_id, 'failed', error=str(e))
             return {
                 'statusCode': 500,
                 'headers': headers,
@@ -185,8 +342,13 @@ def lambda_handler(event, context):
     
     except Exception as e:
         logger.error(f"Unhandled exception: {str(e)}")
+        jobs.record_job_status(job_id, 'failed', error=str(e))
         return {
             'statusCode': 500,
             'headers': headers,
             'body': json.dumps({'error': f'An unexpected error occurred: {str(e)}'})
-        }
\ No newline at end of file
+        }
+    finally:
+        # Later identical requests start a new job, or hit the response cache
+        jobs.release_flight(flight_key, job_id)
+        request_metrics.emit()
\ No newline at end of file
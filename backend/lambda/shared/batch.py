@@ -0,0 +1,332 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import clients
+from boto3.dynamodb.conditions import Key
+from throttle import is_throttling
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Table holding one header row per batch and one row per document
+BATCH_TABLE_NAME = os.environ.get('BATCH_TABLE_NAME')
+BATCH_TTL_SECONDS = int(os.environ.get('BATCH_TTL_SECONDS', str(30 * 24 * 3600)))
+
+# Documents evaluated at once, and retries of a throttled document before it
+# is marked failed
+BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', '4'))
+BATCH_MAX_RETRIES = int(os.environ.get('BATCH_MAX_RETRIES', '5'))
+BATCH_BACKOFF_BASE_SECONDS = float(os.environ.get('BATCH_BACKOFF_BASE_SECONDS', '1'))
+BATCH_BACKOFF_MAX_SECONDS = float(os.environ.get('BATCH_BACKOFF_MAX_SECONDS', '30'))
+
+# Prefix results are written under, as <prefix>/<batchId>/<documentKey>.txt
+RESULTS_PREFIX = os.environ.get('BATCH_RESULTS_PREFIX', 'batch-results')
+
+# Sort key of the row describing the batch itself
+HEADER_KEY = '#batch'
+
+STATUSES = ('pending', 'running', 'completed', 'failed')
+
+
+def result_key(batch_id, document_key):
+    return f'{RESULTS_PREFIX}/{batch_id}/{document_key}.txt'
+
+
+class S3DocumentStore:
+    """
+    Documents and results in an S3 bucket
+    """
+
+    def __init__(self, bucket_name):
+        self.bucket_name = bucket_name
+        self.s3 = clients.get_client('s3')
+
+    def list_keys(self, prefix):
+        keys = []
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+            keys.extend(item['Key'] for item in page.get('Contents', []) if not item['Key'].endswith('/'))
+        return keys
+
+    def read(self, key):
+        return self.s3.get_object(Bucket=self.bucket_name, Key=key)['Body'].read()
+
+    def write(self, key, text):
+        self.s3.put_object(Bucket=self.bucket_name, Key=key, Body=text.encode('utf-8'),
+                           ContentType='text/plain; charset=utf-8')
+
+
+class LocalDocumentStore:
+    """
+    Stand-in for S3DocumentStore backed by a directory, for running batches
+    offline
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def list_keys(self, prefix):
+        keys = []
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                key = os.path.relpath(os.path.join(directory, name), self.root).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    keys.append(key)
+        return sorted(keys)
+
+    def read(self, key):
+        with open(os.path.join(self.root, key), 'rb') as f:
+            return f.read()
+
+    def write(self, key, text):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+
+class DynamoDBBatchTable:
+    """
+    Batch and per-document status in BATCH_TABLE_NAME, keyed by batchId and
+    documentKey
+    """
+
+    def __init__(self, table_name=None):
+        self.table = clients.get_resource('dynamodb').Table(table_name or BATCH_TABLE_NAME)
+
+    def put(self, item):
+        self.table.put_item(Item=dict(item, ttl=int(time.time()) + BATCH_TTL_SECONDS))
+
+    def put_many(self, items):
+        expires = int(time.time()) + BATCH_TTL_SECONDS
+        with self.table.batch_writer() as writer:
+            for item in items:
+                writer.put_item(Item=dict(item, ttl=expires))
+
+    def get(self, batch_id, document_key):
+        return self.table.get_item(Key={'batchId': batch_id, 'documentKey': document_key}).get('Item')
+
+    def update(self, batch_id, document_key, **attributes):
+        names = {f'#{key}': key for key in attributes}
+        self.table.update_item(
+            Key={'batchId': batch_id, 'documentKey': document_key},
+            UpdateExpression='SET ' + ', '.join(f'#{key} = :{key}' for key in attributes),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues={f':{key}': value for key, value in attributes.items()}
+        )
+
+    def query(self, batch_id):
+        params = {'KeyConditionExpression': Key('batchId').eq(batch_id)}
+        while True:
+            response = self.table.query(**params)
+            for item in response.get('Items', []):
+                yield item
+            if 'LastEvaluatedKey' not in response:
+                return
+            params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+class MemoryBatchTable:
+    """
+    Stand-in for DynamoDBBatchTable kept in a dict, for running batches
+    offline
+    """
+
+    def __init__(self):
+        self.items = {}
+        self._lock = threading.Lock()
+
+    def put(self, item):
+        with self._lock:
+            self.items[(item['batchId'], item['documentKey'])] = dict(item)
+
+    def put_many(self, items):
+        for item in items:
+            self.put(item)
+
+    def get(self, batch_id, document_key):
+        with self._lock:
+            item = self.items.get((batch_id, document_key))
+            return None if item is None else dict(item)
+
+    def update(self, batch_id, document_key, **attributes):
+        with self._lock:
+            item = self.items.setdefault((batch_id, document_key),
+                                         {'batchId': batch_id, 'documentKey': document_key})
+            item.update(attributes)
+
+    def query(self, batch_id):
+        with self._lock:
+            items = [dict(item) for key, item in sorted(self.items.items()) if key[0] == batch_id]
+        return iter(items)
+
+
+def create_batch(table, batch_id, document_keys, prompt, model_id, **attributes):
+    """
+    Record a new batch and a pending row for each of its documents
+    """
+    now = int(time.time())
+    keys = sorted(set(document_keys))
+    table.put(dict(attributes, batchId=batch_id, documentKey=HEADER_KEY, prompt=prompt,
+                   modelId=model_id, total=len(keys), status='pending', createdAt=now, updatedAt=now))
+    table.put_many({'batchId': batch_id, 'documentKey': key, 'status': 'pending',
+                    'attempts': 0, 'updatedAt': now} for key in keys)
+    return keys
+
+
+def get_progress(table, batch_id, include_documents=False):
+    """
+    Aggregate document statuses of a batch. Returns None for unknown batches.
+    """
+    header = None
+    counts = dict.fromkeys(STATUSES, 0)
+    documents = []
+    for item in table.query(batch_id):
+        if item['documentKey'] == HEADER_KEY:
+            header = item
+            continue
+        counts[item['status']] = counts.get(item['status'], 0) + 1
+        if include_documents:
+            documents.append({key: item.get(key) for key in
+                              ('documentKey', 'status', 'attempts', 'resultKey', 'chars', 'error')
+                              if item.get(key) is not None})
+    if header is None:
+        return None
+
+    total = sum(counts.values())
+    done = counts['completed'] + counts['failed']
+    progress = {
+        'batchId': batch_id,
+        'status': header['status'],
+        'modelId': header.get('modelId'),
+        'total': total,
+        'counts': counts,
+        'percentComplete': round(100.0 * done / total, 1) if total else 100.0
+    }
+    if include_documents:
+        progress['documents'] = documents
+    return progress
+
+
+class BatchScheduler:
+    """
+    Run the pending documents of a batch through evaluate(document_bytes,
+    document_key, prompt, model_id) with at most max_concurrency in flight.
+
+    Throttled documents are retried with jittered exponential backoff and the
+    concurrency limit is halved. The limit grows back by one after as many
+    consecutive successes as its current value, up to max_concurrency.
+    Documents left in 'running' by an interrupted worker are picked up again.
+    """
+
+    def __init__(self, documents, table, evaluate, max_concurrency=None, max_retries=None,
+                 backoff_base=None, backoff_max=None, sleep=time.sleep):
+        self.documents = documents
+        self.table = table
+        self.evaluate = evaluate
+        self.max_concurrency = max_concurrency or BATCH_MAX_CONCURRENCY
+        self.max_retries = BATCH_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_base = BATCH_BACKOFF_BASE_SECONDS if backoff_base is None else backoff_base
+        self.backoff_max = BATCH_BACKOFF_MAX_SECONDS if backoff_max is None else backoff_max
+        self.sleep = sleep
+        self.limit = self.max_concurrency
+        self.active = 0
+        self.throttles = 0
+        self._successes = 0
+        self._slots = threading.Condition()
+
+    def run(self, batch_id, should_stop=None):
+        """
+        Evaluate every pending document of the batch, or until should_stop()
+        returns True. Returns the number of documents still to do.
+        """
+        should_stop = should_stop or (lambda: False)
+        header = self.table.get(batch_id, HEADER_KEY)
+        todo = [item['documentKey'] for item in self.table.query(batch_id)
+                if item['documentKey'] != HEADER_KEY and item['status'] in ('pending', 'running')]
+        self.table.update(batch_id, HEADER_KEY, status='running', updatedAt=int(time.time()))
+        logger.info(f"Batch {batch_id}: {len(todo)} documents to evaluate")
+
+        started = 0
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            for document_key in todo:
+                self._acquire()
+                if should_stop():
+                    self._release()
+                    break
+                pool.submit(self._process, batch_id, document_key, header['prompt'], header['modelId'])
+                started += 1
+
+        remaining = len(todo) - started
+        if remaining == 0:
+            self.table.update(batch_id, HEADER_KEY, status='completed', updatedAt=int(time.time()))
+        return remaining
+
+    def _acquire(self):
+        with self._slots:
+            while self.active >= self.limit:
+                self._slots.wait()
+            self.active += 1
+
+    def _release(self):
+        with self._slots:
+            self.active -= 1
+            self._slots.notify_all()
+
+    def _throttled(self):
+        with self._slots:
+            self.throttles += 1
+            self._successes = 0
+            self.limit = max(1, self.limit // 2)
+        logger.info(f"Throttled, concurrency limit now {self.limit}")
+
+    def _succeeded(self):
+        with self._slots:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.max_concurrency:
+                self.limit += 1
+                self._successes = 0
+                self._slots.notify_all()
+
+    def _process(self, batch_id, document_key, prompt, model_id):
+        try:
+            attempt = 0
+            while True:
+                attempt += 1
+                self.table.update(batch_id, document_key, status='running', attempts=attempt,
+                                  updatedAt=int(time.time()))
+                try:
+                    text = self.evaluate(self.documents.read(document_key), document_key, prompt, model_id)
+                    key = result_key(batch_id, document_key)
+                    self.documents.write(key, text)
+                    self.table.update(batch_id, document_key, status='completed', resultKey=key,
+                                      chars=len(text), updatedAt=int(time.time()))
+                    self._succeeded()
+                    return
+                except Exception as e:
+                    if is_throttling(e) and attempt <= self.max_retries:
+                        self._throttled()
+                        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+                        self.sleep(random.uniform(0, delay))
+                        continue
+                    logger.error(f"Error evaluating {document_key} in batch {batch_id}: {str(e)}")
+                    self.table.update(batch_id, document_key, status='failed', error=str(e)[:1000],
+                                      updatedAt=int(time.time()))
+                    return
+        finally:
+            self._release()
+
+
+def read_manifest(documents, manifest_key):
+    """
+    Read document keys from a manifest: a JSON list, or one key per line
+    """
+    body = documents.read(manifest_key).decode('utf-8')
+    if body.lstrip().startswith('['):
+        return json.loads(body)
+    return [line.strip() for line in body.splitlines() if line.strip()]
@@ -0,0 +1,157 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+import clients
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Optional DynamoDB table shared by all containers; only the in-memory tier
+# is used when unset
+CACHE_TABLE_NAME = os.environ.get('CACHE_TABLE_NAME')
+
+# DynamoDB items are limited to 400 KB, leave room for the key and attributes
+MAX_SHARED_ITEM_BYTES = 350 * 1024
+
+
+class TTLCache:
+    """
+    Thread-safe in-memory LRU cache whose entries expire after ttl_seconds.
+    Kept at module level by callers so it survives warm invocations.
+    When max_bytes is set, sizeof(value) is tracked and the least recently
+    used entries are evicted to stay under it.
+    """
+
+    def __init__(self, max_entries=256, ttl_seconds=300, max_bytes=None, sizeof=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: 0)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def put(self, key, value, ttl_seconds=None):
+        expires = time.monotonic() + (self.ttl_seconds if ttl_seconds is None else ttl_seconds)
+        size = self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires, value, size)
+            self._bytes += size
+            while (len(self._entries) > self.max_entries
+                   or (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        self._bytes -= self._entries.pop(key)[2]
+
+    def invalidate(self, predicate=None):
+        """
+        Remove the entries whose key matches predicate, or every entry
+        """
+        with self._lock:
+            keys = [key for key in self._entries if predicate is None or predicate(key)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'bytes': self._bytes
+            }
+
+
+class DynamoDBCache:
+    """
+    Cache tier shared by all containers, stored in CACHE_TABLE_NAME as JSON
+    values under a 'cacheKey' hash key, with 'createdAt' in epoch milliseconds.
+    Expired items are ignored even before DynamoDB TTL deletes them.
+    """
+
+    def __init__(self, table_name=None, ttl_seconds=3600):
+        self.table_name = table_name or CACHE_TABLE_NAME
+        self.ttl_seconds = ttl_seconds
+        self._table = None
+
+    @property
+    def enabled(self):
+        return bool(self.table_name)
+
+    @property
+    def table(self):
+        if self._table is None:
+            self._table = clients.get_resource('dynamodb').Table(self.table_name)
+        return self._table
+
+    def get_many(self, keys):
+        """
+        Fetch several keys in one round trip, returning {key: item} for the
+        live ones
+        """
+        if not self.enabled or not keys:
+            return {}
+        try:
+            response = clients.get_resource('dynamodb').batch_get_item(
+                RequestItems={self.table_name: {'Keys': [{'cacheKey': key} for key in keys]}}
+            )
+        except Exception as e:
+            logger.error(f"Error reading shared cache: {str(e)}")
+            return {}
+
+        now = int(time.time())
+        items = {}
+        for item in response.get('Responses', {}).get(self.table_name, []):
+            if int(item.get('ttl', now + 1)) > now:
+                item['value'] = json.loads(item['value']) if 'value' in item else None
+                items[item['cacheKey']] = item
+        return items
+
+    def get(self, key):
+        item = self.get_many([key]).get(key)
+        return None if item is None else item['value']
+
+    def put(self, key, value, ttl_seconds=None, **attributes):
+        if not self.enabled:
+            return False
+        body = json.dumps(value)
+        if len(body.encode('utf-8')) > MAX_SHARED_ITEM_BYTES:
+            logger.info(f"Skipping shared cache write for {key}, value too large")
+            return False
+
+        now = time.time()
+        item = dict(attributes, cacheKey=key, value=body, createdAt=int(now * 1000),
+                    ttl=int(now) + (self.ttl_seconds if ttl_seconds is None else ttl_seconds))
+        try:
+            self.table.put_item(Item=item)
+            return True
+        except Exception as e:
+            logger.error(f"Error writing shared cache: {str(e)}")
+            return False
@@ -0,0 +1,92 @@
+import os
+import threading
+import boto3
+from botocore.config import Config
+
+# Region used for Bedrock model invocations
+BEDROCK_REGION = os.environ.get('BEDROCK_REGION', 'us-west-2')
+
+# Client settings per service. Bedrock runtime streams for minutes, so it
+# gets a long read timeout; everything else fails fast.
+DEFAULT_CONFIG = Config(
+    connect_timeout=5,
+    read_timeout=60,
+    max_pool_connections=10,
+    tcp_keepalive=True,
+    retries={'max_attempts': 3, 'mode': 'standard'}
+)
+SERVICE_CONFIGS = {
+    'bedrock-runtime': Config(
+        connect_timeout=5,
+        read_timeout=int(os.environ.get('BEDROCK_READ_TIMEOUT', '300')),
+        max_pool_connections=int(os.environ.get('BEDROCK_MAX_POOL_CONNECTIONS', '25')),
+        tcp_keepalive=True,
+        retries={'max_attempts': 3, 'mode': 'standard'}
+    ),
+    'bedrock-agent-runtime': Config(
+        connect_timeout=5,
+        read_timeout=30,
+        max_pool_connections=10,
+        tcp_keepalive=True,
+        retries={'max_attempts': 3, 'mode': 'standard'}
+    ),
+}
+SERVICE_REGIONS = {
+    'bedrock-runtime': BEDROCK_REGION,
+}
+
+_clients = {}
+_resources = {}
+_lock = threading.Lock()
+
+def get_client(service_name, region_name=None):
+    """
+    Return the boto3 client for a service, creating it once per container
+    """
+    region_name = region_name or SERVICE_REGIONS.get(service_name)
+    key = (service_name, region_name)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = boto3.client(
+                    service_name,
+                    region_name=region_name,
+                    config=SERVICE_CONFIGS.get(service_name, DEFAULT_CONFIG)
+                )
+                _clients[key] = client
+    return client
+
+def set_client(service_name, client, region_name=None):
+    """
+    Install a client for a service in place of the boto3 one, e.g. a fake
+    used by the offline benchmarks
+    """
+    region_name = region_name or SERVICE_REGIONS.get(service_name)
+    with _lock:
+        _clients[(service_name, region_name)] = client
+
+def get_resource(service_name, region_name=None):
+    """
+    Return the boto3 resource for a service, creating it once per container
+    """
+    key = (service_name, region_name)
+    resource = _resources.get(key)
+    if resource is None:
+        with _lock:
+            resource = _resources.get(key)
+            if resource is None:
+                resource = boto3.resource(
+                    service_name,
+                    region_name=region_name,
+                    config=SERVICE_CONFIGS.get(service_name, DEFAULT_CONFIG)
+                )
+                _resources[key] = resource
+    return resource
+
+def bedrock_runtime():
+    return get_client('bedrock-runtime')
+
+def bedrock_agent_runtime():
+    return get_client('bedrock-agent-runtime')
@@ -0,0 +1,63 @@
+import builtins
+import json
+import logging
+import os
+import sys
+import time
+from collections import defaultdict
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# When enabled, every top-level import made after this module is loaded is
+# timed, and report() logs the per-module cost once per container
+REPORT_ENABLED = os.environ.get('IMPORT_TIME_REPORT', '').lower() in ('1', 'true', 'yes')
+
+IMPORT_TIMES = defaultdict(float)
+
+_init_start = time.perf_counter()
+_original_import = builtins.__import__
+_depth = 0
+_reported = False
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    """
+    builtins.__import__ replacement that records the inclusive time of each
+    top-level import statement
+    """
+    global _depth
+    if level == 0 and name in sys.modules:
+        return _original_import(name, globals, locals, fromlist, level)
+
+    start = time.perf_counter()
+    _depth += 1
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        _depth -= 1
+        if _depth == 0:
+            IMPORT_TIMES[name] += time.perf_counter() - start
+
+if REPORT_ENABLED:
+    builtins.__import__ = _timed_import
+
+def report(function_name=None):
+    """
+    Log the import-time report for this container. Only the first call after
+    a cold start logs anything.
+    """
+    global _reported
+    if not REPORT_ENABLED or _reported:
+        return None
+    _reported = True
+    builtins.__import__ = _original_import
+
+    imports = sorted(IMPORT_TIMES.items(), key=lambda item: item[1], reverse=True)
+    summary = {
+        'coldStart': function_name or os.environ.get('AWS_LAMBDA_FUNCTION_NAME'),
+        'initMs': round((time.perf_counter() - _init_start) * 1000, 1),
+        'importsMs': {name: round(seconds * 1000, 1) for name, seconds in imports}
+    }
+    logger.info(json.dumps(summary))
+    return summary
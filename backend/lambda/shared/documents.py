@@ -0,0 +1,160 @@
+import base64
+import hashlib
+import logging
+import os
+import threading
+import cache
+import clients
+from botocore.exceptions import ClientError
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Uploaded documents are stored once per content, under
+# <DOCUMENTS_PREFIX><sha256>, so the hash doubles as a stable document id
+DOCUMENTS_PREFIX = os.environ.get('DOCUMENTS_PREFIX', 'documents/')
+
+# Document bytes kept per warm container; the functions have 256 MB
+DOCUMENT_CACHE_MAX_BYTES = int(os.environ.get('DOCUMENT_CACHE_MAX_BYTES', str(48 * 1024 * 1024)))
+DOCUMENT_CACHE_TTL_SECONDS = int(os.environ.get('DOCUMENT_CACHE_TTL_SECONDS', '900'))
+
+# Size of the pieces S3 bodies are read and hashed in
+READ_CHUNK_BYTES = int(os.environ.get('DOCUMENT_READ_CHUNK_BYTES', str(1024 * 1024)))
+
+_bytes_cache = cache.TTLCache(
+    max_entries=64,
+    ttl_seconds=DOCUMENT_CACHE_TTL_SECONDS,
+    max_bytes=DOCUMENT_CACHE_MAX_BYTES,
+    sizeof=len
+)
+# Ids of documents stored under other keys, by (key, ETag)
+_ids = cache.TTLCache(max_entries=1024, ttl_seconds=DOCUMENT_CACHE_TTL_SECONDS)
+_stats_lock = threading.Lock()
+_stats = {'downloads': 0, 'bytesDownloaded': 0, 'uploads': 0, 'deduplicated': 0}
+
+
+def _count(**increments):
+    with _stats_lock:
+        for name, value in increments.items():
+            _stats[name] += value
+
+def document_key(document_id):
+    return f'{DOCUMENTS_PREFIX}{document_id}'
+
+def id_from_key(key):
+    """
+    The document id of a hash-addressed key, or None for any other key
+    """
+    if key and key.startswith(DOCUMENTS_PREFIX):
+        candidate = key[len(DOCUMENTS_PREFIX):]
+        if len(candidate) == 64 and all(c in '0123456789abcdef' for c in candidate):
+            return candidate
+    return None
+
+def hash_chunks(chunks):
+    """
+    Hash an iterable of byte chunks, returning (sha256 hex, bytes)
+    """
+    digest = hashlib.sha256()
+    data = bytearray()
+    for chunk in chunks:
+        digest.update(chunk)
+        data.extend(chunk)
+    return digest.hexdigest(), bytes(data)
+
+
+class Document:
+    """
+    A document in the bucket, identified by the sha256 of its content. The
+    bytes are only downloaded when .content is first used, and are shared by
+    every request in the container that asks for the same id.
+    """
+
+    def __init__(self, bucket_name, key, document_id=None, s3=None):
+        self.bucket_name = bucket_name
+        self.key = key
+        self.s3 = s3 or clients.get_client('s3')
+        self._id = document_id or id_from_key(key)
+        self._content = None
+
+    @property
+    def id(self):
+        """
+        sha256 of the content; a HEAD request, or a streamed read for keys
+        that are neither hash-addressed nor carry a sha256 in their metadata
+        """
+        if self._id is None:
+            head = self.s3.head_object(Bucket=self.bucket_name, Key=self.key)
+            self._id = head.get('Metadata', {}).get('sha256') or _ids.get((self.key, head.get('ETag')))
+            if self._id is None:
+                self._download()
+                _ids.put((self.key, head.get('ETag')), self._id)
+        return self._id
+
+    @property
+    def content(self):
+        if self._content is None:
+            if self._id is not None:
+                self._content = _bytes_cache.get(self._id)
+            if self._content is None:
+                self._download()
+        return self._content
+
+    def _download(self):
+        response = self.s3.get_object(Bucket=self.bucket_name, Key=self.key)
+        document_id, content = hash_chunks(response['Body'].iter_chunks(READ_CHUNK_BYTES))
+        _count(downloads=1, bytesDownloaded=len(content))
+        if self._id is not None and self._id != document_id:
+            logger.warning(f"Content of {self.key} does not match document id {self._id}")
+        self._id = document_id
+        self._content = content
+        _bytes_cache.put(document_id, content)
+
+
+def store(bucket_name, content, content_type='application/pdf', filename=None, s3=None):
+    """
+    Store uploaded bytes under their hash-addressed key unless that content
+    is already there. Returns (Document, deduplicated).
+    """
+    s3 = s3 or clients.get_client('s3')
+    digest = hashlib.sha256(content)
+    document_id = digest.hexdigest()
+    key = document_key(document_id)
+
+    try:
+        s3.head_object(Bucket=bucket_name, Key=key)
+        deduplicated = True
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey', 'NotFound'):
+            raise
+        deduplicated = False
+
+    if deduplicated:
+        _count(deduplicated=1)
+        logger.info(f"Document {document_id} already stored, skipping upload")
+    else:
+        metadata = {'sha256': document_id}
+        if filename:
+            # S3 user metadata must be ASCII
+            metadata['original-filename'] = filename.encode('ascii', 'replace').decode('ascii')
+        s3.put_object(
+            Bucket=bucket_name,
+            Key=key,
+            Body=content,
+            ContentType=content_type,
+            Metadata=metadata,
+            ChecksumSHA256=base64.b64encode(digest.digest()).decode('ascii')
+        )
+        _count(uploads=1)
+
+    document = Document(bucket_name, key, document_id, s3=s3)
+    document._content = content
+    _bytes_cache.put(document_id, content)
+    return document, deduplicated
+
+def stats():
+    with _stats_lock:
+        result = dict(_stats)
+    result['cache'] = _bytes_cache.stats()
+    return result
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import logging
+import os
+import time
+import clients
+from botocore.exceptions import ClientError
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Table holding the status of evaluation jobs; status is only logged when unset
+JOBS_TABLE_NAME = os.environ.get('JOBS_TABLE_NAME')
+JOB_TTL_SECONDS = int(os.environ.get('JOB_TTL_SECONDS', str(7 * 24 * 3600)))
+
+# Identical requests share one running job: the first takes a lease on a
+# flight#<key> row of the jobs table and later ones follow its job id. The
+# lease outlives the worker timeout, so a job that crashed frees the key.
+FLIGHT_LEASE_SECONDS = int(os.environ.get('JOB_FLIGHT_LEASE_SECONDS', '330'))
+
+_jobs_table = None
+
+def get_jobs_table():
+    """
+    Return the DynamoDB jobs table, creating the resource on first use
+    """
+    global _jobs_table
+    if _jobs_table is None:
+        _jobs_table = clients.get_resource('dynamodb').Table(JOBS_TABLE_NAME)
+    return _jobs_table
+
+def record_job_status(job_id, status, **attributes):
+    """
+    Record the status of an evaluation job (running, completed, cancelled,
+    failed) along with any extra attributes
+    """
+    logger.info(f"Job {job_id} is {status}")
+    if not job_id or not JOBS_TABLE_NAME:
+        return
+
+    now = int(time.time())
+    values = dict(attributes, status=status, updatedAt=now, ttl=now + JOB_TTL_SECONDS)
+    names = {f'#{key}': key for key in values}
+    try:
+        get_jobs_table().update_item(
+            Key={'jobId': job_id},
+            UpdateExpression='SET ' + ', '.join(f'#{key} = :{key}' for key in values),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues={f':{key}': value for key, value in values.items()}
+        )
+    except Exception as e:
+        logger.error(f"Error recording status for job {job_id}: {str(e)}")
+
+def flight_key(**parts):
+    """
+    Key shared by requests that would produce the same evaluation
+    """
+    body = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+    return 'flight#' + hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+def acquire_flight(key, job_id):
+    """
+    Take the lease on key for job_id, unless a live job holds it already.
+    Returns (job id to follow, True when job_id took the lease). Requests
+    start their own job when there is no jobs table or the table fails.
+    """
+    if not key or not JOBS_TABLE_NAME:
+        return job_id, True
+
+    table = get_jobs_table()
+    # A second attempt covers a lease released between the put and the read
+    for _ in range(2):
+        now = int(time.time())
+        try:
+            table.put_item(
+                Item={
+                    'jobId': key,
+                    'flightJobId': job_id,
+                    'leaseExpires': now + FLIGHT_LEASE_SECONDS,
+                    'ttl': now + FLIGHT_LEASE_SECONDS
+                },
+                ConditionExpression='attribute_not_exists(jobId) OR leaseExpires < :now',
+                ExpressionAttributeValues={':now': now}
+            )
+            return job_id, True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                logger.error(f"Error taking lease {key}: {str(e)}")
+                return job_id, True
+        try:
+            holder = table.get_item(Key={'jobId': key}, ConsistentRead=True).get('Item')
+        except Exception as e:
+            logger.error(f"Error reading lease {key}: {str(e)}")
+            return job_id, True
+        if holder and holder['leaseExpires'] >= now:
+            logger.info(f"Joining job {holder['flightJobId']} for {key}")
+            return holder['flightJobId'], False
+    return job_id, True
+
+def release_flight(key, job_id):
+    """
+    Release the lease on key if job_id still holds it
+    """
+    if not key or not job_id or not JOBS_TABLE_NAME:
+        return
+    try:
+        get_jobs_table().delete_item(
+            Key={'jobId': key},
+            ConditionExpression='flightJobId = :jobId',
+            ExpressionAttributeValues={':jobId': job_id}
+        )
+    except ClientError as e:
+        # The lease expired and another job took it over
+        if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+            logger.error(f"Error releasing lease {key}: {str(e)}")
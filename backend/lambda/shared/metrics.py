@@ -0,0 +1,187 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from aws_lambda_powertools.metrics import EphemeralMetrics, MetricUnit
+
+# CloudWatch namespace and service dimension of the per-request metrics
+METRICS_NAMESPACE = os.environ.get('POWERTOOLS_METRICS_NAMESPACE', 'PdfEvaluator')
+METRICS_SERVICE = os.environ.get('POWERTOOLS_SERVICE_NAME', 'pdf-evaluator')
+
+# 'emf' prints each record to stdout where CloudWatch extracts the metrics,
+# 'local' keeps them in local_records instead (tests, benchmarks)
+METRICS_SINK = os.environ.get('METRICS_SINK', 'emf')
+
+local_records = []
+
+def emf_sink(record):
+    print(json.dumps(record))
+
+def local_sink(record):
+    local_records.append(record)
+
+_sink = local_sink if METRICS_SINK == 'local' else emf_sink
+
+def set_sink(sink):
+    """
+    Send metric records to sink(record) instead of stdout
+    """
+    global _sink
+    _sink = sink
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * p / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+class RequestMetrics:
+    """
+    Timings and token usage of one request, emitted as a single EMF record
+    with Operation and ModelId dimensions:
+
+    - KnowledgeBaseLatency, and any other timer()
+    - TimeToFirstToken, from stream_started() to the first text delta
+    - InterChunkGapP50/P90/P99/Max between text deltas
+    - StreamDuration, from stream_started() to the last stream event
+    - InputTokens, OutputTokens, CacheReadInputTokens, CacheWriteInputTokens
+      and BedrockLatency from the metadata event or converse usage
+    - WebSocketSendLatencyP50/P99/Max, WebSocketSends, WebSocketSendFailures
+    - AdmissionWait, AdmissionQueueDepth, BedrockThrottles and BedrockRetries
+      from the throttle module
+
+    Sends are recorded from the sender thread, so updates take a lock.
+    """
+
+    def __init__(self, operation, model_id=None, **properties):
+        self.operation = operation
+        self.model_id = model_id
+        self.properties = properties
+        self.values = {}
+        self.send_latencies = []
+        self.send_failures = 0
+        self.emitted = False
+        self._stream_started_at = None
+        self._first_chunk_at = None
+        self._last_chunk_at = None
+        self._last_event_at = None
+        self._gaps = []
+        self._lock = threading.Lock()
+
+    def record(self, name, value, unit=MetricUnit.Milliseconds):
+        with self._lock:
+            self.values[name] = (unit, value)
+
+    def increment(self, name, value=1, unit=MetricUnit.Count):
+        with self._lock:
+            self.values[name] = (unit, self.values.get(name, (unit, 0))[1] + value)
+
+    def maximum(self, name, value, unit=MetricUnit.Count):
+        with self._lock:
+            if name not in self.values or value > self.values[name][1]:
+                self.values[name] = (unit, value)
+
+    @contextmanager
+    def timer(self, name):
+        """
+        Record the time spent in the block, in milliseconds
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000)
+
+    def stream_started(self):
+        self._stream_started_at = time.perf_counter()
+
+    def stream_event(self, event):
+        """
+        Account for one converse_stream event
+        """
+        now = time.perf_counter()
+        self._last_event_at = now
+        if 'contentBlockDelta' in event:
+            if self._first_chunk_at is None:
+                self._first_chunk_at = now
+            else:
+                self._gaps.append((now - self._last_chunk_at) * 1000)
+            self._last_chunk_at = now
+        elif 'metadata' in event:
+            self.usage(event['metadata'].get('usage', {}), event['metadata'].get('metrics', {}).get('latencyMs'))
+
+    def usage(self, usage, latency_ms=None):
+        """
+        Add the token usage of a converse response or metadata event; requests
+        that make several Bedrock calls report the totals
+        """
+        if 'inputTokens' in usage:
+            self.increment('InputTokens', usage['inputTokens'])
+        if 'outputTokens' in usage:
+            self.increment('OutputTokens', usage['outputTokens'])
+        if 'cacheReadInputTokens' in usage:
+            self.increment('CacheReadInputTokens', usage['cacheReadInputTokens'])
+        if 'cacheWriteInputTokens' in usage:
+            self.increment('CacheWriteInputTokens', usage['cacheWriteInputTokens'])
+        if latency_ms is not None:
+            self.increment('BedrockLatency', latency_ms, MetricUnit.Milliseconds)
+
+    def record_send(self, latency_ms, ok):
+        with self._lock:
+            self.send_latencies.append(latency_ms)
+            if not ok:
+                self.send_failures += 1
+
+    def summary(self):
+        """
+        All metrics as {name: (unit, value)}
+        """
+        with self._lock:
+            values = dict(self.values)
+            sends = list(self.send_latencies)
+            failures = self.send_failures
+
+        if self._stream_started_at is not None:
+            if self._first_chunk_at is not None:
+                values['TimeToFirstToken'] = (MetricUnit.Milliseconds,
+                                              (self._first_chunk_at - self._stream_started_at) * 1000)
+            if self._last_event_at is not None:
+                values['StreamDuration'] = (MetricUnit.Milliseconds,
+                                            (self._last_event_at - self._stream_started_at) * 1000)
+        if self._gaps:
+            for name, p in (('InterChunkGapP50', 50), ('InterChunkGapP90', 90), ('InterChunkGapP99', 99)):
+                values[name] = (MetricUnit.Milliseconds, percentile(self._gaps, p))
+            values['InterChunkGapMax'] = (MetricUnit.Milliseconds, max(self._gaps))
+        values['WebSocketSends'] = (MetricUnit.Count, len(sends))
+        values['WebSocketSendFailures'] = (MetricUnit.Count, failures)
+        if sends:
+            values['WebSocketSendLatencyP50'] = (MetricUnit.Milliseconds, percentile(sends, 50))
+            values['WebSocketSendLatencyP99'] = (MetricUnit.Milliseconds, percentile(sends, 99))
+            values['WebSocketSendLatencyMax'] = (MetricUnit.Milliseconds, max(sends))
+        return values
+
+    def emit(self):
+        """
+        Send the record to the sink, once
+        """
+        if self.emitted:
+            return None
+        self.emitted = True
+
+        emf = EphemeralMetrics(namespace=METRICS_NAMESPACE, service=METRICS_SERVICE)
+        emf.add_dimension('Operation', self.operation)
+        if self.model_id:
+            emf.add_dimension('ModelId', self.model_id)
+        for name, (unit, value) in sorted(self.summary().items()):
+            emf.add_metric(name=name, unit=unit, value=round(value, 3))
+        for key, value in self.properties.items():
+            if value is not None:
+                emf.add_metadata(key=key, value=value)
+        record = emf.serialize_metric_set()
+        _sink(record)
+        return record
@@ -0,0 +1,72 @@
+import os
+import string
+
+# Bedrock prompt caching: a cachePoint block after the static part of a
+# message lets the provider reuse it on later calls with the same prefix
+PROMPT_CACHE_ENABLED = os.environ.get('PROMPT_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+# Model ids (or fragments of them, so inference profiles match too) that
+# accept cache points
+PROMPT_CACHE_MODELS = [
+    model.strip() for model in os.environ.get(
+        'PROMPT_CACHE_MODELS',
+        'anthropic.claude-3-7-sonnet,anthropic.claude-3-5-haiku,anthropic.claude-sonnet-4,'
+        'anthropic.claude-opus-4,amazon.nova'
+    ).split(',') if model.strip()
+]
+
+# Prefixes shorter than the provider minimum (1,024 tokens for most Claude
+# models) are not cached, so no cache point is added for them
+PROMPT_CACHE_MIN_CHARS = int(os.environ.get('PROMPT_CACHE_MIN_CHARS', '4000'))
+
+CACHE_POINT = {'cachePoint': {'type': 'default'}}
+
+def supports(model_id):
+    return PROMPT_CACHE_ENABLED and any(model in (model_id or '') for model in PROMPT_CACHE_MODELS)
+
+def content(model_id, static_blocks, dynamic_blocks=()):
+    """
+    Message content with the static blocks first, followed by a cache point
+    when the model supports one and the static text is long enough, then
+    the per-request blocks. Blank text blocks are left out, as Converse
+    rejects them; with no static text there is no cache point either.
+    """
+    blocks = [block for block in static_blocks if block.get('text', True)]
+    static_chars = sum(len(block.get('text', '')) for block in blocks)
+    if supports(model_id) and static_chars >= PROMPT_CACHE_MIN_CHARS:
+        blocks.append(CACHE_POINT)
+    return blocks + list(dynamic_blocks)
+
+def _unparse(fields):
+    """
+    Turn string.Formatter().parse() output back into template text
+    """
+    parts = []
+    for literal, name, spec, conversion in fields:
+        parts.append(literal.replace('{', '{{').replace('}', '}}'))
+        if name is not None:
+            parts.append('{' + name + ('!' + conversion if conversion else '') + (':' + spec if spec else '') + '}')
+    return ''.join(parts)
+
+def split_template(prompt_template, **values):
+    """
+    Split a str.format template at its first placeholder into the static
+    text before it and the rest formatted with values. The two parts joined
+    equal prompt_template.format(**values). A template whose first
+    placeholder is not one of values is returned whole as the first part.
+    """
+    try:
+        fields = list(string.Formatter().parse(prompt_template))
+    except ValueError:
+        return prompt_template.format(**values), ''
+
+    for index, (literal, name, spec, conversion) in enumerate(fields):
+        if name is None:
+            continue
+        if name not in values:
+            break
+        # The parsed literals already have escaped braces resolved
+        static = ''.join(field[0] for field in fields[:index + 1])
+        rest = _unparse([('', name, spec, conversion)] + fields[index + 1:])
+        return static, rest.format(**values)
+    return prompt_template.format(**values), ''
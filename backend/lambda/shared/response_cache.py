@@ -0,0 +1,79 @@
+import hashlib
+import json
+import logging
+import os
+import cache
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Cache of complete model responses for deterministic (temperature 0) calls,
+# keyed by everything that goes into the request
+RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', '128'))
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', str(16 * 1024 * 1024)))
+RESPONSE_CACHE_TTL_SECONDS = int(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', '3600'))
+RESPONSE_SHARED_CACHE_TTL_SECONDS = int(os.environ.get('RESPONSE_SHARED_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+
+# Size of the pieces a cached response is replayed in
+REPLAY_CHUNK_CHARS = int(os.environ.get('RESPONSE_REPLAY_CHUNK_CHARS', '512'))
+
+_memory = cache.TTLCache(
+    RESPONSE_CACHE_SIZE,
+    RESPONSE_CACHE_TTL_SECONDS,
+    max_bytes=RESPONSE_CACHE_MAX_BYTES,
+    sizeof=lambda text: len(text.encode('utf-8'))
+)
+_shared = cache.DynamoDBCache(ttl_seconds=RESPONSE_SHARED_CACHE_TTL_SECONDS)
+
+def document_hash(file_bytes):
+    return hashlib.sha256(file_bytes).hexdigest()
+
+def cache_key(model_id, inference_config, **parts):
+    """
+    Build a content-addressed key from the model id, inference settings and
+    request parts (prompt, template, retrieved context, document hash, ...).
+    Returns None when the request is not deterministic.
+    """
+    if not RESPONSE_CACHE_ENABLED or inference_config.get('temperature', 1) != 0:
+        return None
+    digest = hashlib.sha256(json.dumps(
+        {'modelId': model_id, 'inferenceConfig': inference_config, 'parts': parts},
+        sort_keys=True,
+        default=str
+    ).encode('utf-8')).hexdigest()
+    return f'response#{digest}'
+
+def get(key):
+    """
+    Return the cached response text for a key, checking memory then DynamoDB
+    """
+    if key is None:
+        return None
+    text = _memory.get(key)
+    if text is None:
+        text = _shared.get(key)
+        if text is not None:
+            _memory.put(key, text)
+    if text is not None:
+        logger.info(f"Response cache hit for {key}")
+    return text
+
+def put(key, text, model_id=None):
+    if key is None or not text:
+        return
+    _memory.put(key, text)
+    _shared.put(key, text, modelId=model_id)
+
+def replay(sender, text, **extra):
+    """
+    Send a cached response over the regular chunk/done/fullResponse protocol
+    and return it
+    """
+    for start in range(0, len(text), REPLAY_CHUNK_CHARS):
+        sender.add(text[start:start + REPLAY_CHUNK_CHARS])
+    return sender.close(cached=True, **extra)
+
+def stats():
+    return _memory.stats()
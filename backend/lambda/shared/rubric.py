@@ -0,0 +1,99 @@
+import re
+from collections import namedtuple
+
+# Ratings are asked for on a fixed scale so they can be aggregated; a section
+# that is missing from the document is rated 0
+RATING_SCALE = 5
+
+Section = namedtuple('Section', ['number', 'title', 'criteria'])
+SectionResult = namedtuple('SectionResult', ['section', 'rating', 'text'])
+
+# The block tags have to stand on their own line, so prose that mentions
+# "the <sections> tags" is not taken for the block; a block left open runs
+# to the end of the prompt
+_SECTIONS_OPEN_RE = re.compile(r'^[ \t]*<sections>[ \t]*$', re.MULTILINE | re.IGNORECASE)
+_SECTIONS_CLOSE_RE = re.compile(r'^[ \t]*</sections>[ \t]*$', re.MULTILINE | re.IGNORECASE)
+_HEADING_RE = re.compile(r'^\s*(\d+)\.\s+(.+?)\s*$', re.MULTILINE)
+_RATING_RE = re.compile(r'RATING:\s*(\d+(?:\.\d+)?)', re.IGNORECASE)
+
+SECTION_INSTRUCTIONS = """Evaluate only the following section of the document. Ignore all other sections.
+
+<section>
+{number}. {title}
+{criteria}
+</section>
+
+Explain how the document meets or misses each criterion. If the section is not
+present in the document, say so and rate it 0. End your answer with a single
+line of the form "RATING: <n>" where n is an integer from 0 to {scale}."""
+
+def parse_sections(prompt):
+    """
+    Split a rubric prompt into the text around its <sections> block and the
+    numbered sections inside it. The block may be left unterminated.
+    Returns (preamble, []) when the prompt has no sections block.
+    """
+    opening = _SECTIONS_OPEN_RE.search(prompt or '')
+    if not opening:
+        return prompt, []
+
+    closing = _SECTIONS_CLOSE_RE.search(prompt, opening.end())
+    body_end, rest_start = (closing.start(), closing.end()) if closing else (len(prompt), len(prompt))
+    preamble = (prompt[:opening.start()] + prompt[rest_start:]).strip()
+    body = prompt[opening.end():body_end]
+    headings = list(_HEADING_RE.finditer(body))
+    sections = []
+    for index, heading in enumerate(headings):
+        end = headings[index + 1].start() if index + 1 < len(headings) else len(body)
+        sections.append(Section(
+            number=int(heading.group(1)),
+            title=heading.group(2),
+            criteria=body[heading.end():end].strip()
+        ))
+    return preamble, sections
+
+def section_prompt_parts(preamble, section):
+    """
+    The rubric preamble shared by every section, and the instructions for
+    this section
+    """
+    return preamble + "\n\n", SECTION_INSTRUCTIONS.format(
+        number=section.number,
+        title=section.title,
+        criteria=section.criteria,
+        scale=RATING_SCALE
+    )
+
+def section_prompt(preamble, section):
+    return ''.join(section_prompt_parts(preamble, section))
+
+def parse_rating(text):
+    """
+    Read the last 'RATING: n' line of a section answer, clamped to the
+    scale. Returns None when the model did not give one.
+    """
+    ratings = _RATING_RE.findall(text or '')
+    if not ratings:
+        return None
+    return max(0.0, min(float(RATING_SCALE), float(ratings[-1])))
+
+def aggregate(results):
+    """
+    Overall rating: the mean of the section ratings, with unrated sections
+    counted as 0, rounded to one decimal
+    """
+    if not results:
+        return None
+    total = sum(result.rating or 0.0 for result in results)
+    return round(total / len(results), 1)
+
+def format_section(result):
+    rating = 'not rated' if result.rating is None else f'{result.rating:g}/{RATING_SCALE}'
+    return f"## {result.section.number}. {result.section.title} ({rating})\n\n{result.text.strip()}\n\n"
+
+def format_overall(results):
+    lines = [f"## Overall rating: {aggregate(results):g}/{RATING_SCALE}\n"]
+    for result in sorted(results, key=lambda r: r.section.number):
+        rating = 'not rated' if result.rating is None else f'{result.rating:g}'
+        lines.append(f"- {result.section.number}. {result.section.title}: {rating}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,107 @@
+import json
+import logging
+import os
+import threading
+import time
+import clients
+from boto3.dynamodb.conditions import Key
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Table holding the frames of each streamed job, keyed by jobId and seq, so
+# a client that reconnects can be sent what it missed
+STREAM_SEGMENTS_TABLE_NAME = os.environ.get('STREAM_SEGMENTS_TABLE_NAME')
+STREAM_SEGMENT_TTL_SECONDS = int(os.environ.get('STREAM_SEGMENT_TTL_SECONDS', str(24 * 3600)))
+
+# Frames are written in batches: every SEGMENT_FLUSH_FRAMES frames, after
+# SEGMENT_FLUSH_SECONDS, and when the stream ends
+SEGMENT_FLUSH_FRAMES = int(os.environ.get('STREAM_SEGMENT_FLUSH_FRAMES', '10'))
+SEGMENT_FLUSH_SECONDS = float(os.environ.get('STREAM_SEGMENT_FLUSH_SECONDS', '1'))
+
+# DynamoDB items are limited to 400 KB; larger frames are stored without
+# their fullResponse (WS_FINAL_FRAME_MODE=full), which the client rebuilds
+# from the chunks
+MAX_SEGMENT_CHARS = int(os.environ.get('STREAM_SEGMENT_MAX_CHARS', '300000'))
+
+_segments_table = None
+
+
+def enabled():
+    return bool(STREAM_SEGMENTS_TABLE_NAME)
+
+def get_segments_table():
+    """
+    Return the DynamoDB stream segments table, creating the resource on first use
+    """
+    global _segments_table
+    if _segments_table is None:
+        _segments_table = clients.get_resource('dynamodb').Table(STREAM_SEGMENTS_TABLE_NAME)
+    return _segments_table
+
+def encode(message):
+    body = json.dumps(message)
+    if len(body) > MAX_SEGMENT_CHARS and 'fullResponse' in message:
+        body = json.dumps({key: value for key, value in message.items() if key != 'fullResponse'})
+    return body
+
+
+class StreamLog:
+    """
+    Durable copy of the frames sent for one job. append() is called with
+    every frame, in seq order, and the frames are written in batches.
+    """
+
+    def __init__(self, job_id, table=None):
+        self.job_id = job_id
+        self.table = table
+        self.segments_written = 0
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def append(self, message):
+        with self._lock:
+            self._pending.append((message['seq'], encode(message)))
+            due = (len(self._pending) >= SEGMENT_FLUSH_FRAMES
+                   or time.monotonic() - self._last_flush >= SEGMENT_FLUSH_SECONDS
+                   or message.get('done'))
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        expires_at = int(time.time()) + STREAM_SEGMENT_TTL_SECONDS
+        try:
+            with (self.table or get_segments_table()).batch_writer() as batch:
+                for seq, body in pending:
+                    batch.put_item(Item={'jobId': self.job_id, 'seq': seq, 'message': body, 'ttl': expires_at})
+            self.segments_written += len(pending)
+        except Exception as e:
+            logger.error(f"Error writing stream segments for job {self.job_id}: {str(e)}")
+
+    def close(self):
+        self.flush()
+
+
+def read_segments(job_id, from_seq=0, table=None):
+    """
+    Return the frames stored for a job from seq from_seq on, in order
+    """
+    table = table or get_segments_table()
+    query_kwargs = {
+        'KeyConditionExpression': Key('jobId').eq(job_id) & Key('seq').gte(from_seq),
+        'ConsistentRead': True
+    }
+    frames = []
+    while True:
+        response = table.query(**query_kwargs)
+        frames.extend(json.loads(item['message']) for item in response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return frames
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
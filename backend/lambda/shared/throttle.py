@@ -0,0 +1,311 @@
+import logging
+import os
+import random
+import threading
+import time
+from aws_lambda_powertools.metrics import MetricUnit
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Admission rates per model and container. A request waits until both the
+# request bucket and the token bucket can cover it, so a burst of parallel
+# sections or batch documents is spread out instead of throttled by Bedrock.
+BEDROCK_REQUESTS_PER_MINUTE = float(os.environ.get('BEDROCK_REQUESTS_PER_MINUTE', '50'))
+BEDROCK_TOKENS_PER_MINUTE = float(os.environ.get('BEDROCK_TOKENS_PER_MINUTE', '200000'))
+
+# Longest a request waits for admission before it is sent anyway
+BEDROCK_ADMISSION_TIMEOUT_SECONDS = float(os.environ.get('BEDROCK_ADMISSION_TIMEOUT_SECONDS', '60'))
+
+# Retries of a throttled call, only while nothing has been streamed yet
+BEDROCK_MAX_RETRIES = int(os.environ.get('BEDROCK_MAX_RETRIES', '4'))
+BEDROCK_BACKOFF_BASE_SECONDS = float(os.environ.get('BEDROCK_BACKOFF_BASE_SECONDS', '0.5'))
+BEDROCK_BACKOFF_MAX_SECONDS = float(os.environ.get('BEDROCK_BACKOFF_MAX_SECONDS', '20'))
+
+# Output tokens charged up front per request; the estimate is corrected
+# once the response reports its usage
+ESTIMATED_OUTPUT_TOKENS = int(os.environ.get('BEDROCK_ESTIMATED_OUTPUT_TOKENS', '1000'))
+
+# Rate adaptation: each throttle halves the admitted rate down to
+# MIN_RATE_FACTOR of the configured one, each success wins back RATE_RECOVERY
+MIN_RATE_FACTOR = 0.1
+RATE_RECOVERY = 0.05
+
+# Error codes meaning Bedrock rejected the request for capacity. Errors
+# raised from inside a stream use the lower camel case event names.
+THROTTLING_ERRORS = ('ThrottlingException', 'TooManyRequestsException', 'ServiceQuotaExceededException')
+_THROTTLING_CODES = {code.lower() for code in THROTTLING_ERRORS}
+
+
+def is_throttling(error):
+    """
+    True when an exception from Bedrock means the request was throttled
+    """
+    code = getattr(error, 'response', {}).get('Error', {}).get('Code') or ''
+    return code.lower() in _THROTTLING_CODES or type(error).__name__.lower() in _THROTTLING_CODES
+
+def backoff_delay(attempt, base=None, maximum=None):
+    """
+    Full-jitter exponential backoff before retry number `attempt`
+    """
+    base = BEDROCK_BACKOFF_BASE_SECONDS if base is None else base
+    maximum = BEDROCK_BACKOFF_MAX_SECONDS if maximum is None else maximum
+    return random.uniform(0, min(maximum, base * 2 ** (attempt - 1)))
+
+def estimate_tokens(messages, inference_config=None):
+    """
+    Rough token cost of a request: about four characters per token of text,
+    a flat cost per document or image, plus the expected output
+    """
+    chars = 0
+    attachments = 0
+    for message in messages or []:
+        for block in message.get('content', []):
+            if 'text' in block:
+                chars += len(block['text'])
+            elif 'document' in block or 'image' in block:
+                attachments += 1
+    max_tokens = (inference_config or {}).get('maxTokens', ESTIMATED_OUTPUT_TOKENS)
+    return chars // 4 + attachments * 1500 + min(max_tokens, ESTIMATED_OUTPUT_TOKENS)
+
+
+class ModelLimiter:
+    """
+    Adaptive token-bucket admission for one model. acquire() blocks until a
+    request and its estimated tokens fit in the buckets; throttled() cuts
+    the refill rate and succeeded() restores it gradually.
+    """
+
+    def __init__(self, model_id, requests_per_minute=None, tokens_per_minute=None,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.model_id = model_id
+        self.requests_per_second = (requests_per_minute or BEDROCK_REQUESTS_PER_MINUTE) / 60.0
+        self.tokens_per_second = (tokens_per_minute or BEDROCK_TOKENS_PER_MINUTE) / 60.0
+        # A full minute of capacity can be spent at once
+        self.request_capacity = self.requests_per_second * 60
+        self.token_capacity = self.tokens_per_second * 60
+        self.clock = clock
+        self.sleep = sleep
+        self.rate_factor = 1.0
+        self.requests = self.request_capacity
+        self.tokens = self.token_capacity
+        self.waiting = 0
+        self.throttles = 0
+        self._updated_at = clock()
+        self._condition = threading.Condition()
+
+    def _refill(self):
+        now = self.clock()
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        self.requests = min(self.request_capacity,
+                            self.requests + elapsed * self.requests_per_second * self.rate_factor)
+        self.tokens = min(self.token_capacity,
+                          self.tokens + elapsed * self.tokens_per_second * self.rate_factor)
+
+    def acquire(self, tokens, timeout=None):
+        """
+        Wait until one request and `tokens` tokens are available and take
+        them. Returns (seconds waited, requests queued ahead on arrival).
+        """
+        timeout = BEDROCK_ADMISSION_TIMEOUT_SECONDS if timeout is None else timeout
+        # A request bigger than the bucket would never fit
+        tokens = min(tokens, self.token_capacity)
+        started_at = self.clock()
+        with self._condition:
+            queue_depth = self.waiting
+            self.waiting += 1
+            try:
+                while True:
+                    self._refill()
+                    if self.requests >= 1 and self.tokens >= tokens:
+                        break
+                    remaining = started_at + timeout - self.clock()
+                    if remaining <= 0:
+                        logger.warning(f"Admission for {self.model_id} timed out, sending anyway")
+                        break
+                    needed = max(
+                        (1 - self.requests) / (self.requests_per_second * self.rate_factor),
+                        (tokens - self.tokens) / (self.tokens_per_second * self.rate_factor)
+                    )
+                    self._condition.wait(min(max(needed, 0.01), remaining))
+                self.requests -= 1
+                self.tokens -= tokens
+            finally:
+                self.waiting -= 1
+        return self.clock() - started_at, queue_depth
+
+    def settle(self, estimated, actual):
+        """
+        Correct the token bucket once the real usage of a request is known
+        """
+        with self._condition:
+            self.tokens = min(self.token_capacity, self.tokens + estimated - actual)
+            self._condition.notify_all()
+
+    def throttled(self):
+        with self._condition:
+            self.throttles += 1
+            self.rate_factor = max(MIN_RATE_FACTOR, self.rate_factor / 2)
+            # Stop admitting the burst that was just rejected
+            self.requests = min(self.requests, 0)
+        logger.info(f"Throttled by Bedrock, {self.model_id} admission rate now {self.rate_factor:.2f}x")
+
+    def succeeded(self):
+        with self._condition:
+            if self.rate_factor < 1.0:
+                self.rate_factor = min(1.0, self.rate_factor + RATE_RECOVERY)
+                self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            self._refill()
+            return {
+                'modelId': self.model_id,
+                'rateFactor': round(self.rate_factor, 3),
+                'requestsAvailable': round(self.requests, 2),
+                'tokensAvailable': round(self.tokens),
+                'waiting': self.waiting,
+                'throttles': self.throttles
+            }
+
+
+_limiters = {}
+_lock = threading.Lock()
+
+def get_limiter(model_id):
+    """
+    Return the limiter for a model, creating it once per container
+    """
+    limiter = _limiters.get(model_id)
+    if limiter is None:
+        with _lock:
+            limiter = _limiters.get(model_id)
+            if limiter is None:
+                limiter = ModelLimiter(model_id)
+                _limiters[model_id] = limiter
+    return limiter
+
+def set_limiter(model_id, limiter):
+    """
+    Install a limiter for a model, e.g. one with a fake clock
+    """
+    with _lock:
+        _limiters[model_id] = limiter
+
+def stats():
+    with _lock:
+        limiters = list(_limiters.values())
+    return [limiter.stats() for limiter in limiters]
+
+def _admit(limiter, estimated, metrics):
+    waited, queue_depth = limiter.acquire(estimated)
+    if metrics is not None:
+        metrics.increment('AdmissionWait', waited * 1000, MetricUnit.Milliseconds)
+        metrics.maximum('AdmissionQueueDepth', queue_depth)
+
+def _throttled(limiter, attempt, error, metrics, max_retries):
+    limiter.throttled()
+    if metrics is not None:
+        metrics.increment('BedrockThrottles')
+    if attempt > (BEDROCK_MAX_RETRIES if max_retries is None else max_retries):
+        return False
+    delay = backoff_delay(attempt)
+    logger.info(f"Retrying {limiter.model_id} in {delay:.2f}s after: {str(error)}")
+    if metrics is not None:
+        metrics.increment('BedrockRetries')
+    limiter.sleep(delay)
+    return True
+
+def converse(client, metrics=None, max_retries=None, **kwargs):
+    """
+    client.converse(**kwargs) behind the model's limiter, retrying throttles
+    up to max_retries times (BEDROCK_MAX_RETRIES by default)
+    """
+    limiter = get_limiter(kwargs.get('modelId'))
+    estimated = estimate_tokens(kwargs.get('messages'), kwargs.get('inferenceConfig'))
+    attempt = 0
+    while True:
+        attempt += 1
+        _admit(limiter, estimated, metrics)
+        try:
+            response = client.converse(**kwargs)
+        except Exception as e:
+            if is_throttling(e) and _throttled(limiter, attempt, e, metrics, max_retries):
+                continue
+            raise
+        limiter.succeeded()
+        usage = response.get('usage', {})
+        if 'inputTokens' in usage:
+            limiter.settle(estimated, usage['inputTokens'] + usage.get('outputTokens', 0))
+        return response
+
+def converse_stream(client, metrics=None, max_retries=None, **kwargs):
+    """
+    client.converse_stream(**kwargs) behind the model's limiter. Throttles
+    are retried when the call is made and while reading the stream, but
+    only until the first text delta; after that the error is raised as is.
+    """
+    stream = GuardedStream(client, kwargs, metrics, max_retries)
+    stream.start()
+    return {'stream': stream}
+
+
+class GuardedStream:
+    """
+    converse_stream event stream that reopens itself on a throttle that
+    arrives before any text was streamed
+    """
+
+    def __init__(self, client, kwargs, metrics=None, max_retries=None):
+        self.client = client
+        self.kwargs = kwargs
+        self.metrics = metrics
+        self.max_retries = max_retries
+        self.limiter = get_limiter(kwargs.get('modelId'))
+        self.estimated = estimate_tokens(kwargs.get('messages'), kwargs.get('inferenceConfig'))
+        self.attempt = 0
+        self.streamed = False
+        self.closed = False
+        self._stream = None
+
+    def start(self):
+        while True:
+            self.attempt += 1
+            _admit(self.limiter, self.estimated, self.metrics)
+            try:
+                self._stream = self.client.converse_stream(**self.kwargs)['stream']
+                return
+            except Exception as e:
+                if is_throttling(e) and _throttled(self.limiter, self.attempt, e, self.metrics, self.max_retries):
+                    continue
+                raise
+
+    def __iter__(self):
+        while True:
+            try:
+                for event in self._stream:
+                    if 'contentBlockDelta' in event:
+                        self.streamed = True
+                    elif 'metadata' in event:
+                        usage = event['metadata'].get('usage', {})
+                        if 'inputTokens' in usage:
+                            self.limiter.settle(self.estimated,
+                                                usage['inputTokens'] + usage.get('outputTokens', 0))
+                    yield event
+                    if self.closed:
+                        return
+                self.limiter.succeeded()
+                return
+            except Exception as e:
+                if self.streamed or self.closed or not is_throttling(e):
+                    raise
+                if not _throttled(self.limiter, self.attempt, e, self.metrics, self.max_retries):
+                    raise
+                self.start()
+
+    def close(self):
+        self.closed = True
+        if self._stream is not None and hasattr(self._stream, 'close'):
+            self._stream.close()
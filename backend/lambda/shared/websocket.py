@@ -0,0 +1,686 @@
+import base64
+import hashlib
+import json
+import logging
+import boto3
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import clients
+import stream_log
+from boto3.dynamodb.conditions import Key
+from botocore.config import Config
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Coalescing thresholds for streamed chunks
+FLUSH_MAX_CHARS = int(os.environ.get('WS_FLUSH_MAX_CHARS', '512'))
+FLUSH_INTERVAL_MS = int(os.environ.get('WS_FLUSH_INTERVAL_MS', '75'))
+
+# Bounded queue between the Bedrock reader and the background sender, and what
+# to do with a chunk when it is full: 'merge', 'drop' or 'block'
+SEND_QUEUE_SIZE = int(os.environ.get('WS_SEND_QUEUE_SIZE', '256'))
+SEND_OVERFLOW_POLICY = os.environ.get('WS_SEND_OVERFLOW_POLICY', 'merge')
+
+# 'direct' posts to API Gateway in-process, 'lambda' goes through the
+# websocket-send-message function
+SEND_MODE = os.environ.get('WEBSOCKET_SEND_MODE', 'direct')
+SEND_MESSAGE_FUNCTION = os.environ.get('WEBSOCKET_SEND_MESSAGE_FUNCTION')
+
+# Connections table used to detect clients that went away without a failed post
+CONNECTIONS_TABLE_NAME = os.environ.get('CONNECTIONS_TABLE_NAME')
+CONNECTION_CHECK_SECONDS = float(os.environ.get('WS_CONNECTION_CHECK_SECONDS', '10'))
+
+# Connection rows expire after the longest an API Gateway WebSocket
+# connection can stay open (2 hours), in case $disconnect never arrives
+CONNECTION_TTL_SECONDS = int(os.environ.get('CONNECTION_TTL_SECONDS', '7200'))
+
+# Index of the connections table by the job a connection is subscribed to,
+# and the number of connections a frame is posted to at once
+CONNECTIONS_JOB_INDEX = os.environ.get('CONNECTIONS_JOB_INDEX', 'jobId-index')
+MULTICAST_MAX_WORKERS = int(os.environ.get('WS_MULTICAST_MAX_WORKERS', '8'))
+
+# How often a job's subscriber list is re-read, so a connection that
+# subscribes or resumes starts receiving live frames soon after
+SUBSCRIBER_REFRESH_SECONDS = float(os.environ.get('WS_SUBSCRIBER_REFRESH_SECONDS', '2'))
+
+# A job whose frames are persisted keeps streaming this long after its last
+# connection is gone, so the client can reconnect and resume
+RESUME_GRACE_SECONDS = float(os.environ.get('WS_RESUME_GRACE_SECONDS', '30'))
+
+# Most recent frames kept in memory for connections that join a job
+RECENT_FRAMES = int(os.environ.get('WS_RECENT_FRAMES', '64'))
+
+# How the final frame carries the complete response. 'full' puts it in the
+# done frame. 'digest' only sends its size and sha256 when the streamed chunks
+# already add up to it, and part frames otherwise. 'split' always sends part
+# frames. Parts can be deflate compressed, and the data of each one is at
+# most FINAL_PART_BYTES once serialized, well under API Gateway's 32 KB
+# frame size. json.dumps escapes non-ASCII text, up to 12 bytes a character.
+FINAL_FRAME_MODE = os.environ.get('WS_FINAL_FRAME_MODE', 'digest')
+FINAL_PART_BYTES = int(os.environ.get('WS_FINAL_PART_BYTES', '24000'))
+FINAL_COMPRESSION = os.environ.get('WS_FINAL_COMPRESSION', 'deflate')
+
+# Status code returned by the senders when the client has disconnected
+GONE_STATUS_CODE = 410
+
+# Bounded cache of API Gateway Management API clients, keyed by domain/stage,
+# kept at module level so it survives warm invocations
+CLIENT_CACHE_SIZE = int(os.environ.get('WS_CLIENT_CACHE_SIZE', '8'))
+GATEWAY_CLIENT_CONFIG = Config(
+    max_pool_connections=int(os.environ.get('WS_MAX_POOL_CONNECTIONS', '20')),
+    tcp_keepalive=True,
+    connect_timeout=2,
+    read_timeout=5,
+    retries={'max_attempts': 2, 'mode': 'standard'}
+)
+
+_gateway_clients = OrderedDict()
+_gateway_clients_lock = threading.Lock()
+_client_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+_connections_table = None
+_multicast_pool = None
+_multicast_pool_lock = threading.Lock()
+
+
+class ClientDisconnected(Exception):
+    """
+    Raised to abort a stream whose WebSocket client has disconnected
+    """
+
+def get_gateway_client(domain_name):
+    """
+    Return a cached API Gateway Management API client for a WebSocket
+    domain/stage, creating it on first use
+    """
+    endpoint = domain_name.replace('wss://', '').replace('https://', '').rstrip('/')
+
+    with _gateway_clients_lock:
+        client = _gateway_clients.get(endpoint)
+        if client is not None:
+            _gateway_clients.move_to_end(endpoint)
+            _client_cache_stats['hits'] += 1
+            return client
+
+        _client_cache_stats['misses'] += 1
+        client = boto3.client(
+            'apigatewaymanagementapi',
+            endpoint_url=f'https://{endpoint}',
+            config=GATEWAY_CLIENT_CONFIG
+        )
+        _gateway_clients[endpoint] = client
+        if len(_gateway_clients) > CLIENT_CACHE_SIZE:
+            _gateway_clients.popitem(last=False)
+            _client_cache_stats['evictions'] += 1
+        return client
+
+def set_gateway_client(domain_name, client):
+    """
+    Install the API Gateway Management API client used for a domain/stage,
+    e.g. a fake used by the offline benchmarks
+    """
+    endpoint = domain_name.replace('wss://', '').replace('https://', '').rstrip('/')
+    with _gateway_clients_lock:
+        _gateway_clients[endpoint] = client
+
+def client_cache_stats():
+    """
+    Return hit/miss/eviction counters and the current size of the client cache
+    """
+    with _gateway_clients_lock:
+        stats = dict(_client_cache_stats)
+        stats['size'] = len(_gateway_clients)
+    return stats
+
+def send_websocket_message(connection_id, domain_name, message):
+    """
+    Send a message to a WebSocket client, either directly or through the
+    websocket-send-message Lambda function depending on WEBSOCKET_SEND_MODE.
+    domain_name is the API's domain/stage, with or without a wss:// or
+    https:// scheme; callers include the stage, the senders never add it.
+    """
+    if SEND_MODE == 'lambda' and SEND_MESSAGE_FUNCTION:
+        return invoke_send_message_function(connection_id, domain_name, message)
+    return post_to_connection(connection_id, domain_name, message)
+
+def invoke_send_message_function(connection_id, domain_name, message):
+    """
+    Fallback sender that invokes the websocket-send-message Lambda function
+    """
+    response = clients.get_client('lambda').invoke(
+        FunctionName=SEND_MESSAGE_FUNCTION,
+        InvocationType='RequestResponse',
+        Payload=json.dumps({
+            'connectionId': connection_id,
+            'domainName': domain_name,
+            'message': message
+        })
+    )
+    return json.loads(response['Payload'].read())
+
+def post_to_connection(connection_id, domain_name, message):
+    """
+    Post a message to a WebSocket client through the API Gateway Management API
+    """
+    
+    logger.info(f"Sending message to connection {connection_id}")
+    
+    if not connection_id or not domain_name:
+        logger.error("Missing required parameters")
+        return {'statusCode': 400, 'body': 'Missing required parameters'}
+    
+    # Reuse the API Gateway Management API client for this endpoint
+    gateway_api = get_gateway_client(domain_name)
+    
+    try:
+        # Send the message to the connected client
+        gateway_api.post_to_connection(
+            ConnectionId=connection_id,
+            Data=json.dumps(message).encode('utf-8')
+        )
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'message': 'Message sent successfully'})
+        }
+    except gateway_api.exceptions.GoneException:
+        logger.warning(f"Connection {connection_id} is gone")
+        return {
+            'statusCode': GONE_STATUS_CODE,
+            'body': json.dumps({'error': 'Connection is gone'})
+        }
+    except Exception as e:
+        logger.error(f"Error sending message: {str(e)}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'error': str(e)})
+        }
+
+# Serialized length of each ASCII character inside a JSON string
+_ASCII_JSON_LENGTHS = [len(json.dumps(chr(code))) - 2 for code in range(128)]
+
+def serialized_length(text):
+    """
+    Bytes text takes inside a JSON string as json.dumps writes it
+    """
+    return len(json.dumps(text)) - 2
+
+def split_serialized(text, max_bytes):
+    """
+    Split text into pieces whose serialized length is at most max_bytes
+    """
+    if serialized_length(text) == len(text):
+        return [text[start:start + max_bytes] for start in range(0, len(text), max_bytes)] or ['']
+    pieces = []
+    start = 0
+    size = 0
+    for index, char in enumerate(text):
+        code = ord(char)
+        length = _ASCII_JSON_LENGTHS[code] if code < 0x80 else (6 if code < 0x10000 else 12)
+        if size + length > max_bytes and index > start:
+            pieces.append(text[start:index])
+            start = index
+            size = 0
+        size += length
+    pieces.append(text[start:])
+    return pieces
+
+def final_frames(text, streamed_sha256=None, mode=None, compression=None, part_bytes=None, **extra):
+    """
+    Frames that end a stream whose complete response is text: any part
+    frames, then the done frame with extra merged in. streamed_sha256 is the
+    digest of the chunks already sent.
+    """
+    mode = mode or FINAL_FRAME_MODE
+    compression = compression or FINAL_COMPRESSION
+    part_bytes = part_bytes or FINAL_PART_BYTES
+    if mode == 'full':
+        return [dict({'chunk': '', 'done': True, 'fullResponse': text}, **extra)]
+
+    encoded = text.encode('utf-8')
+    done = {'chunk': '', 'done': True, 'bytes': len(encoded), 'sha256': hashlib.sha256(encoded).hexdigest(), 'parts': 0}
+    done.update(extra)
+    if mode == 'digest' and done['sha256'] == streamed_sha256:
+        return [done]
+
+    encoding = 'identity'
+    data = text
+    if compression == 'deflate':
+        compressed = base64.b64encode(zlib.compress(encoded)).decode('ascii')
+        if len(compressed) < serialized_length(text):
+            encoding = 'deflate'
+            data = compressed
+    pieces = split_serialized(data, part_bytes)
+    done.update(parts=len(pieces), encoding=encoding)
+    frames = [
+        {'chunk': '', 'done': False, 'part': index, 'parts': len(pieces), 'encoding': encoding, 'data': piece}
+        for index, piece in enumerate(pieces)
+    ]
+    return frames + [done]
+
+def is_connection_gone(result):
+    """
+    Check whether a sender result reports a disconnected client
+    """
+    return isinstance(result, dict) and result.get('statusCode') == GONE_STATUS_CODE
+
+def get_connections_table():
+    """
+    Return the DynamoDB connections table, creating the resource on first use
+    """
+    global _connections_table
+    if _connections_table is None:
+        _connections_table = clients.get_resource('dynamodb').Table(CONNECTIONS_TABLE_NAME)
+    return _connections_table
+
+def connection_exists(connection_id):
+    """
+    Check the connections table for a WebSocket connection. Returns True when
+    no connections table is configured or the lookup fails.
+    """
+    if not CONNECTIONS_TABLE_NAME or not connection_id:
+        return True
+    try:
+        response = get_connections_table().get_item(
+            Key={'connectionId': connection_id},
+            ProjectionExpression='connectionId'
+        )
+        return 'Item' in response
+    except Exception as e:
+        logger.error(f"Error checking connection {connection_id}: {str(e)}")
+        return True
+
+def subscribe(connection_id, job_id):
+    """
+    Subscribe a connection to the frames of a job and extend its TTL. A
+    connection follows one job at a time.
+    """
+    if not CONNECTIONS_TABLE_NAME or not connection_id or not job_id:
+        return False
+    try:
+        get_connections_table().update_item(
+            Key={'connectionId': connection_id},
+            UpdateExpression='SET jobId = :jobId, #ttl = :ttl',
+            ExpressionAttributeNames={'#ttl': 'ttl'},
+            ExpressionAttributeValues={':jobId': job_id, ':ttl': int(time.time()) + CONNECTION_TTL_SECONDS}
+        )
+        return True
+    except Exception as e:
+        logger.error(f"Error subscribing {connection_id} to job {job_id}: {str(e)}")
+        return False
+
+def job_subscribers(job_id):
+    """
+    Return the ids of the live connections subscribed to a job, or None when
+    the lookup fails
+    """
+    if not CONNECTIONS_TABLE_NAME or not job_id:
+        return None
+    now = int(time.time())
+    query_kwargs = {
+        'IndexName': CONNECTIONS_JOB_INDEX,
+        'KeyConditionExpression': Key('jobId').eq(job_id),
+        'ProjectionExpression': 'connectionId, #ttl',
+        'ExpressionAttributeNames': {'#ttl': 'ttl'}
+    }
+    connection_ids = []
+    try:
+        while True:
+            response = get_connections_table().query(**query_kwargs)
+            # Rows past their TTL can linger until DynamoDB removes them
+            connection_ids.extend(
+                item['connectionId'] for item in response.get('Items', [])
+                if int(item.get('ttl', now)) >= now
+            )
+            if 'LastEvaluatedKey' not in response:
+                return connection_ids
+            query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    except Exception as e:
+        logger.error(f"Error listing subscribers of job {job_id}: {str(e)}")
+        return None
+
+def prune_connections(connection_ids):
+    """
+    Delete the rows of connections that API Gateway reported as gone
+    """
+    if not CONNECTIONS_TABLE_NAME or not connection_ids:
+        return
+    try:
+        with get_connections_table().batch_writer() as batch:
+            for connection_id in set(connection_ids):
+                batch.delete_item(Key={'connectionId': connection_id})
+        logger.info(f"Pruned {len(set(connection_ids))} gone connections")
+    except Exception as e:
+        logger.error(f"Error pruning connections: {str(e)}")
+
+def get_multicast_pool():
+    global _multicast_pool
+    if _multicast_pool is None:
+        with _multicast_pool_lock:
+            if _multicast_pool is None:
+                _multicast_pool = ThreadPoolExecutor(max_workers=MULTICAST_MAX_WORKERS,
+                                                     thread_name_prefix='websocket-multicast')
+    return _multicast_pool
+
+def multicast(connection_ids, domain_name, message, send=send_websocket_message, metrics=None):
+    """
+    Send one message to several connections concurrently and return the
+    sender result for each connection id
+    """
+    def post(connection_id):
+        started = time.perf_counter()
+        result = send(connection_id, domain_name, message)
+        if metrics is not None:
+            metrics.record_send((time.perf_counter() - started) * 1000,
+                                isinstance(result, dict) and result.get('statusCode') == 200)
+        return result
+
+    if len(connection_ids) == 1:
+        return {connection_ids[0]: post(connection_ids[0])}
+    return dict(zip(connection_ids, get_multicast_pool().map(post, connection_ids)))
+
+
+class StreamCoalescer:
+    """
+    Buffers streamed text chunks and sends them to a WebSocket client as
+    batched frames. A frame is flushed once the buffer reaches max_chars,
+    once max_interval_ms has passed since the last flush, or when the
+    stream is closed. Every frame carries an increasing 'seq' number so
+    the client can render frames in order.
+
+    When a post reports the client as gone, or the connection is no longer in
+    the connections table, 'disconnected' is set and further sends are
+    skipped so the caller can abort the Bedrock stream.
+
+    With a job_id, the connection is subscribed to the job and frames go to
+    every connection subscribed to it. The subscriber list is refreshed on
+    the connection check interval, connections reported gone are pruned from
+    the table, and 'disconnected' is only set once none are left.
+
+    When stream segments are persisted (STREAM_SEGMENTS_TABLE_NAME), every
+    frame of a job is written to the stream log so a reconnecting client can
+    resume from a seq, and the stream continues for RESUME_GRACE_SECONDS
+    without any connection before 'disconnected' is set. Connections that
+    join are also sent the frames of the last few seconds, which a resume
+    may have missed while they were not yet persisted.
+
+    The final frame carries the complete response as set by
+    WS_FINAL_FRAME_MODE, see final_frames().
+
+    When a metrics.RequestMetrics is given, the latency and outcome of every
+    send are recorded on it.
+    """
+
+    def __init__(self, connection_id, domain_name, max_chars=None, max_interval_ms=None,
+                 send=send_websocket_message, check_interval=None, metrics=None, job_id=None):
+        self.connection_id = connection_id
+        self.job_id = job_id
+        self.recipients = [connection_id] if connection_id else []
+        self.domain_name = domain_name
+        self.max_chars = FLUSH_MAX_CHARS if max_chars is None else max_chars
+        self.max_interval = (FLUSH_INTERVAL_MS if max_interval_ms is None else max_interval_ms) / 1000.0
+        self.send = send
+        if check_interval is None:
+            check_interval = SUBSCRIBER_REFRESH_SECONDS if job_id and CONNECTIONS_TABLE_NAME else CONNECTION_CHECK_SECONDS
+        self.check_interval = check_interval
+        self.metrics = metrics
+        self.seq = 0
+        self.frames_sent = 0
+        self.disconnected = False
+        self._buffer = []
+        self._buffered_chars = 0
+        self._parts = []
+        self._streamed = hashlib.sha256()
+        self._last_flush = time.monotonic()
+        self._last_check = time.monotonic()
+        self._gone = set()
+        self._orphaned_at = None
+        self._recent = deque(maxlen=RECENT_FRAMES)
+        self.stream_log = stream_log.StreamLog(job_id) if job_id and stream_log.enabled() else None
+        if job_id and connection_id:
+            subscribe(connection_id, job_id)
+
+    @property
+    def full_response(self):
+        return ''.join(self._parts)
+
+    def add(self, text_chunk):
+        """
+        Append a text chunk and flush if a size or time threshold is reached
+        """
+        if not text_chunk:
+            return
+        self._parts.append(text_chunk)
+        self._buffer.append(text_chunk)
+        self._buffered_chars += len(text_chunk)
+
+        now = time.monotonic()
+        if (self._buffered_chars >= self.max_chars
+                or now - self._last_flush >= self.max_interval):
+            self.flush()
+        self._check_connection(now)
+
+    def flush(self):
+        """
+        Send any buffered text as a single frame
+        """
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        chunk = ''.join(self._buffer)
+        self._buffer = []
+        self._buffered_chars = 0
+        self._streamed.update(chunk.encode('utf-8'))
+        self._send({'chunk': chunk, 'done': False})
+
+    def close(self, **extra):
+        """
+        Flush remaining text and send the final 'done' frame. A fullResponse
+        in extra replaces the streamed text as the complete response.
+        """
+        self.flush()
+        text = extra.pop('fullResponse', None)
+        for message in final_frames(self.full_response if text is None else text,
+                                    self._streamed.hexdigest(), **extra):
+            self._send(message)
+        if self.stream_log is not None:
+            self.stream_log.close()
+        return self.full_response
+
+    def abort(self):
+        """
+        Discard buffered text without sending it
+        """
+        self._buffer = []
+        self._buffered_chars = 0
+        if self.stream_log is not None:
+            self.stream_log.close()
+
+    def fail(self, error):
+        """
+        Discard buffered text and end the stream with an error frame, sent
+        to every connection subscribed to the job
+        """
+        self.abort()
+        self._last_check = float('-inf')
+        self._check_connection(time.monotonic())
+        self._send({'chunk': '', 'done': False, 'error': error})
+        if self.stream_log is not None:
+            self.stream_log.close()
+
+    def _recipients_lost(self):
+        """
+        Set 'disconnected' now, or once the resume grace period has passed
+        when the job's frames are persisted
+        """
+        if self.stream_log is None:
+            self.disconnected = True
+            return
+        now = time.monotonic()
+        if self._orphaned_at is None:
+            self._orphaned_at = now
+            logger.info(f"No connections for job {self.job_id}, waiting {RESUME_GRACE_SECONDS}s for a resume")
+        elif now - self._orphaned_at >= RESUME_GRACE_SECONDS:
+            self.disconnected = True
+
+    def _check_connection(self, now):
+        if now - self._last_check < self.check_interval:
+            return
+        if self.job_id and CONNECTIONS_TABLE_NAME:
+            self._last_check = now
+            subscribers = job_subscribers(self.job_id)
+            if subscribers is None:
+                return
+            recipients = [c for c in subscribers if c not in self._gone]
+            # The index is eventually consistent, so look the caller up directly
+            if (self.connection_id and self.connection_id not in self._gone
+                    and self.connection_id not in recipients and connection_exists(self.connection_id)):
+                recipients.insert(0, self.connection_id)
+            joined = [c for c in recipients if c not in self.recipients]
+            self.recipients = recipients
+            if joined:
+                self._catch_up(joined, now)
+            if recipients:
+                self._orphaned_at = None
+            elif self.connection_id:
+                logger.warning(f"No connections left for job {self.job_id}")
+                self._recipients_lost()
+        elif self.connection_id:
+            self._last_check = now
+            if not connection_exists(self.connection_id):
+                logger.warning(f"Connection {self.connection_id} left the connections table")
+                self.disconnected = True
+
+    def _catch_up(self, connection_ids, now):
+        """
+        Send joining connections the frames of the last refresh and log
+        flush intervals, the ones a resume can miss
+        """
+        since = now - self.check_interval - stream_log.SEGMENT_FLUSH_SECONDS - 1
+        for sent_at, message in list(self._recent):
+            if sent_at >= since:
+                multicast(connection_ids, self.domain_name, message, send=self.send, metrics=self.metrics)
+
+    def _send(self, message):
+        message['seq'] = self.seq
+        self.seq += 1
+        if self.stream_log is not None:
+            self.stream_log.append(message)
+            self._recent.append((time.monotonic(), message))
+        if self.disconnected or not self.recipients:
+            return
+        self.frames_sent += 1
+        results = multicast(list(self.recipients), self.domain_name, message, send=self.send, metrics=self.metrics)
+        gone = [connection_id for connection_id, result in results.items() if is_connection_gone(result)]
+        if gone:
+            self._gone.update(gone)
+            self.recipients = [c for c in self.recipients if c not in self._gone]
+            prune_connections(gone)
+            if not self.recipients:
+                self._recipients_lost()
+
+
+class BackgroundStreamSender(StreamCoalescer):
+    """
+    StreamCoalescer that delivers frames from a background thread, so reading
+    the Bedrock stream never waits on API Gateway. Text chunks are handed over
+    through a bounded queue and the sender thread batches whatever is pending
+    into a frame using the same size and time thresholds.
+
+    When the queue is full the overflow policy decides what happens to a new
+    chunk: 'merge' appends it to the newest queued entry, 'drop' leaves it out
+    of the live frames (the final fullResponse is still complete) and 'block'
+    makes the reader wait for room.
+    """
+
+    def __init__(self, connection_id, domain_name, max_queue=None, overflow_policy=None, **kwargs):
+        super().__init__(connection_id, domain_name, **kwargs)
+        self.max_queue = SEND_QUEUE_SIZE if max_queue is None else max_queue
+        self.overflow_policy = overflow_policy or SEND_OVERFLOW_POLICY
+        self.merged = 0
+        self.dropped = 0
+        self._queue = deque()
+        self._queued_chars = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='websocket-sender', daemon=True)
+        self._thread.start()
+
+    def add(self, text_chunk):
+        """
+        Queue a text chunk for the sender thread
+        """
+        if not text_chunk:
+            return
+        self._parts.append(text_chunk)
+
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                if self.overflow_policy == 'drop':
+                    self.dropped += 1
+                    return
+                if self.overflow_policy == 'merge':
+                    self._queue[-1] += text_chunk
+                    self._queued_chars += len(text_chunk)
+                    self.merged += 1
+                    self._cond.notify_all()
+                    return
+                while len(self._queue) >= self.max_queue and not self._closed:
+                    self._cond.wait()
+            self._queue.append(text_chunk)
+            self._queued_chars += len(text_chunk)
+            self._cond.notify_all()
+
+    def close(self, **extra):
+        """
+        Wait for the sender thread to deliver queued text, then send the
+        final 'done' frame
+        """
+        self._stop()
+        return super().close(**extra)
+
+    def abort(self):
+        """
+        Stop the sender thread and discard anything still queued
+        """
+        with self._cond:
+            self._queue.clear()
+            self._queued_chars = 0
+        self._stop()
+        super().abort()
+
+    def _stop(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+
+                # Keep batching until a threshold is reached or the stream ends
+                deadline = self._last_flush + self.max_interval
+                while (not self._closed and self._queued_chars < self.max_chars
+                       and len(self._queue) < self.max_queue
+                       and time.monotonic() < deadline):
+                    self._cond.wait(deadline - time.monotonic())
+
+                items = list(self._queue)
+                self._queue.clear()
+                self._queued_chars = 0
+                self._cond.notify_all()
+
+            self._buffer.extend(items)
+            self._buffered_chars += sum(len(item) for item in items)
+            self.flush()
+            self._check_connection(time.monotonic())
@@ -1,15 +1,19 @@
 import json
 import logging
 import base64
-import boto3
 import os
+import uuid
+import clients
+import documents
+import jobs
+import websocket
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-lambda_client = boto3.client('lambda')
+lambda_client = clients.get_client('lambda')
 BUCKET_NAME = os.environ.get('BUCKET_NAME')
-s3_client = boto3.client('s3')
+s3_client = clients.get_client('s3')
 
 headers = {
     'Content-Type': 'application/json',
@@ -30,22 +34,84 @@ def lambda_handler(event, context):
     request_body = json.loads(event['body'])
 
     try:
+        # Store the upload once per content; the hash is the document id later
+        # stages cache against
+        s3_file_key = request_body.get('s3FileKey')
+        document_id = None
+        deduplicated = False
+        if request_body.get('file'):
+            document, deduplicated = documents.store(
+                BUCKET_NAME,
+                base64.b64decode(request_body['file']),
+                content_type=request_body.get('contentType', 'application/pdf'),
+                filename=request_body.get('fileName'),
+                s3=s3_client
+            )
+            s3_file_key = document.key
+            document_id = document.id
+        if not s3_file_key:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': 'Missing file or s3FileKey'})
+            }
+
+        # Identical requests in flight share one job; the worker function
+        # fixes the model. Documents named by key are identified by it.
+        connection_id = request_body.get('connectionId')
+        flight_key = jobs.flight_key(
+            worker=os.environ.get('BEDROCK_IMAGE_PROCESS_FUNCTION'),
+            document=document_id or documents.id_from_key(s3_file_key) or s3_file_key,
+            prompt=request_body.get('prompt'),
+            evaluationMode=request_body.get('evaluationMode')
+        )
+        job_id, leader = jobs.acquire_flight(flight_key, str(uuid.uuid4()))
+        if not leader:
+            websocket.subscribe(connection_id, job_id)
+            return {
+                'statusCode': 200,
+                'headers': headers,
+                'body': json.dumps({
+                    'message': 'ok',
+                    'jobId': job_id,
+                    'documentId': document_id,
+                    'deduplicated': deduplicated,
+                    'coalesced': True
+                })
+            }
+
         payload = {
-            'connectionId': request_body.get('connectionId'),
+            'jobId': job_id,
+            'flightKey': flight_key,
+            's3FileKey': s3_file_key,
+            'documentId': document_id,
+            'connectionId': connection_id,
             'domainName': request_body.get('domainName'),
-            'prompt': request_body.get('prompt')
+            'prompt': request_body.get('prompt'),
+            'bypassCache': request_body.get('bypassCache', False),
+            'evaluationMode': request_body.get('evaluationMode')
         }
         
-        lambda_client.invoke(
-            FunctionName=os.environ.get('BEDROCK_IMAGE_PROCESS_FUNCTION'),
-            InvocationType='Event',
-            Payload=json.dumps(payload)
-        )
+        try:
+            lambda_client.invoke(
+                FunctionName=os.environ.get('BEDROCK_IMAGE_PROCESS_FUNCTION'),
+                InvocationType='Event',
+                Payload=json.dumps(payload)
+            )
+        except Exception:
+            jobs.release_flight(flight_key, job_id)
+            raise
         
         return {
             'statusCode': 200,
             'headers': headers,
-            'body': json.dumps({'message': 'ok'})
+            'body': json.dumps({
+                'message': 'ok',
+                'jobId': job_id,
+                'documentId': document_id,
+                'deduplicated': deduplicated,
+                'coalesced': False
+            })
         }
     
     except Exception as e:
@@ -1,15 +1,18 @@
 import json
 import logging
 import base64
-import boto3
 import os
+import uuid
+import clients
+import jobs
+import websocket
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-lambda_client = boto3.client('lambda')
+lambda_client = clients.get_client('lambda')
 BUCKET_NAME = os.environ.get('BUCKET_NAME')
-s3_client = boto3.client('s3')
+s3_client = clients.get_client('s3')
 
 headers = {
     'Content-Type': 'application/json',
@@ -30,24 +33,49 @@ def lambda_handler(event, context):
     request_body = json.loads(event['body'])
 
     try:
+        # Identical requests in flight share one job; the worker function
+        # fixes the model
+        connection_id = request_body.get('connectionId')
+        flight_key = jobs.flight_key(
+            worker=os.environ.get('GENERATE_TEXT_RESPONSE_FUNCTION'),
+            bedrockKBID=request_body.get('bedrockKBID'),
+            prompt=request_body.get('prompt'),
+            prompt_template=request_body.get('prompt_template')
+        )
+        job_id, leader = jobs.acquire_flight(flight_key, str(uuid.uuid4()))
+        if not leader:
+            websocket.subscribe(connection_id, job_id)
+            return {
+                'statusCode': 200,
+                'headers': headers,
+                'body': json.dumps({'message': 'ok', 'jobId': job_id, 'coalesced': True})
+            }
+
         payload = {
-            'connectionId': request_body.get('connectionId'),
+            'jobId': job_id,
+            'flightKey': flight_key,
+            'connectionId': connection_id,
             'domainName': request_body.get('domainName'),
             'bedrockKBID': request_body.get('bedrockKBID'),
             'prompt': request_body.get('prompt'),
-            'prompt_template': request_body.get('prompt_template')
+            'prompt_template': request_body.get('prompt_template'),
+            'bypassCache': request_body.get('bypassCache', False)
         }
         
-        lambda_client.invoke(
-            FunctionName=os.environ.get('GENERATE_TEXT_RESPONSE_FUNCTION'),
-            InvocationType='Event',
-            Payload=json.dumps(payload)
-        )
+        try:
+            lambda_client.invoke(
+                FunctionName=os.environ.get('GENERATE_TEXT_RESPONSE_FUNCTION'),
+                InvocationType='Event',
+                Payload=json.dumps(payload)
+            )
+        except Exception:
+            jobs.release_flight(flight_key, job_id)
+            raise
         
         return {
             'statusCode': 200,
             'headers': headers,
-            'body': json.dumps({'message': 'ok'})
+            'body': json.dumps({'message': 'ok', 'jobId': job_id, 'coalesced': False})
         }
     
     except Exception as e:
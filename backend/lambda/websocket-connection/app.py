@@ -1,16 +1,53 @@
 import json
 import logging
-import boto3
 import os
+import time
+import uuid
+import clients
+import stream_log
+import websocket
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Initialize DynamoDB client
-dynamodb = boto3.resource('dynamodb')
+# Initialize DynamoDB and Lambda clients once per container
+dynamodb = clients.get_resource('dynamodb')
+lambda_client = clients.get_client('lambda')
 connections_table = dynamodb.Table(os.environ.get('CONNECTIONS_TABLE_NAME'))
 
+def endpoint_domain(request_context):
+    """
+    The domain/stage the shared websocket senders post to for this API
+    """
+    return f"{request_context['domainName']}/{request_context['stage']}"
+
+def resume_job(connection_id, domain_name, job_id, from_seq):
+    """
+    Send a reconnected client the frames of a job from seq from_seq on and
+    subscribe it to the rest. Returns the number of frames replayed.
+    """
+    # Subscribe first so frames sent while replaying reach the client live
+    websocket.subscribe(connection_id, job_id)
+    frames = stream_log.read_segments(job_id, from_seq) if stream_log.enabled() else []
+
+    # The client orders frames by seq, so they can be posted concurrently
+    results = list(websocket.get_multicast_pool().map(
+        lambda frame: websocket.post_to_connection(connection_id, domain_name, dict(frame, replayed=True)),
+        frames
+    ))
+    if any(websocket.is_connection_gone(result) for result in results):
+        return 0
+
+    websocket.post_to_connection(connection_id, domain_name, {
+        'jobId': job_id,
+        'resumed': True,
+        'fromSeq': from_seq,
+        'replayed': len(frames),
+        'completed': any(frame.get('done') for frame in frames)
+    })
+    return len(frames)
+
 def lambda_handler(event, context):
     """
     Lambda function to handle WebSocket API connect/disconnect events
@@ -25,12 +62,14 @@ def lambda_handler(event, context):
     
     # Handle different route types
     if route_key == '$connect':
-        # Store connection ID in DynamoDB
+        # Store connection ID in DynamoDB, expiring it in case $disconnect is missed
         try:
+            connected_at = int(event.get('requestContext', {}).get('connectedAt', time.time() * 1000)) // 1000
             connections_table.put_item(
                 Item={
                     'connectionId': connection_id,
-                    'timestamp': int(event.get('requestContext', {}).get('requestTime', 0))
+                    'timestamp': connected_at,
+                    'ttl': connected_at + websocket.CONNECTION_TTL_SECONDS
                 }
             )
             return {'statusCode': 200, 'body': 'Connected'}
@@ -55,12 +94,12 @@ def lambda_handler(event, context):
         # Process the message - forward to process-image-bedrock Lambda
         try:
             request_body = json.loads(event.get('body', '{}'))
-            lambda_client = boto3.client('lambda')
             
             # Add WebSocket connection information to the request
             request_body['connectionId'] = connection_id
-            request_body['domainName'] = event['requestContext']['domainName']
+            request_body['domainName'] = endpoint_domain(event['requestContext'])
             request_body['stage'] = event['requestContext']['stage']
+            request_body['jobId'] = str(uuid.uuid4())
             
             # Invoke the process-image-bedrock Lambda asynchronously
             lambda_client.invoke(
@@ -71,12 +110,46 @@ def lambda_handler(event, context):
             
             return {
                 'statusCode': 200,
-                'body': json.dumps({'message': 'Processing started'})
+                'body': json.dumps({'message': 'Processing started', 'jobId': request_body['jobId']})
             }
         except Exception as e:
             logger.error(f"Error processing message: {str(e)}")
             return {'statusCode': 500, 'body': json.dumps({'error': str(e)})}
     
+    elif route_key == 'subscribe':
+        # Follow the frames of a running job, e.g. a second reviewer watching
+        # an evaluation started elsewhere
+        try:
+            job_id = json.loads(event.get('body') or '{}').get('jobId')
+            if not job_id:
+                return {'statusCode': 400, 'body': json.dumps({'error': 'Missing jobId'})}
+            if not websocket.subscribe(connection_id, job_id):
+                return {'statusCode': 500, 'body': json.dumps({'error': 'Failed to subscribe'})}
+            return {
+                'statusCode': 200,
+                'body': json.dumps({'message': 'Subscribed', 'jobId': job_id})
+            }
+        except Exception as e:
+            logger.error(f"Error subscribing connection: {str(e)}")
+            return {'statusCode': 500, 'body': json.dumps({'error': str(e)})}
+
+    elif route_key == 'resume':
+        # Catch a reconnected client up on a job: {"jobId": ..., "fromSeq": N}
+        try:
+            request_body = json.loads(event.get('body') or '{}')
+            job_id = request_body.get('jobId')
+            if not job_id:
+                return {'statusCode': 400, 'body': json.dumps({'error': 'Missing jobId'})}
+            replayed = resume_job(connection_id, endpoint_domain(event['requestContext']), job_id,
+                                  int(request_body.get('fromSeq') or 0))
+            return {
+                'statusCode': 200,
+                'body': json.dumps({'message': 'Resumed', 'jobId': job_id, 'replayed': replayed})
+            }
+        except Exception as e:
+            logger.error(f"Error resuming job: {str(e)}")
+            return {'statusCode': 500, 'body': json.dumps({'error': str(e)})}
+
     # Default response for unsupported routes
     return {
         'statusCode': 400,
@@ -0,0 +1,39 @@
+// finalFrame.js
+// Helpers for the end of a streamed response. The done frame carries the
+// size and sha256 of the complete response; when the streamed chunks do not
+// add up to it, the response is sent before it as sequenced part frames,
+// optionally deflate compressed and base64 encoded.
+
+const inflate = async (base64) => {
+  const bytes = Uint8Array.from(atob(base64), c => c.charCodeAt(0));
+  const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('deflate'));
+  return new Response(stream).text();
+};
+
+/**
+ * Join part frames, indexed by their 'part' number, into the response text
+ */
+export const assembleParts = async (parts, count, encoding) => {
+  const pieces = [];
+  for (let index = 0; index < count; index += 1) {
+    if (!parts[index]) {
+      throw new Error(`Missing part ${index} of ${count}`);
+    }
+    pieces.push(parts[index].data);
+  }
+  const data = pieces.join('');
+  return encoding === 'deflate' ? inflate(data) : data;
+};
+
+/**
+ * Check text against the size and sha256 of a done frame
+ */
+export const matchesDigest = async (text, done) => {
+  const bytes = new TextEncoder().encode(text);
+  if (bytes.length !== done.bytes) {
+    return false;
+  }
+  const digest = await crypto.subtle.digest('SHA-256', bytes);
+  const hex = Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+  return hex === done.sha256;
+};
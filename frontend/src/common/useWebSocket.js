@@ -34,6 +34,8 @@ const useWebSocket = (onMessageCallback) => {
 
       wsClient.onOpen = () => {
         console.log('WebSocket connection established', wsClient);
+        // The client reconnects itself after a drop; make it current again
+        wsClientRef.current = wsClient;
         setWebsocket(wsClient);
         setIsWebSocketConnected(true);
         requestConnectionInfo(wsClient);
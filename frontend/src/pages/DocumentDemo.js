@@ -1,5 +1,6 @@
-import React, { useState, useCallback, useEffect } from 'react';
+import React, { useState, useCallback, useEffect, useRef } from 'react';
 import useWebSocket from '../common/useWebSocket';
+import { assembleParts, matchesDigest } from '../common/finalFrame';
 import {
   Container,
   Header,
@@ -28,23 +29,155 @@ function DocumentDemo() {
   const API_ENDPOINT = process.env.REACT_APP_API_ENDPOINT;
   const API_STAGE = process.env.REACT_APP_APIGATEWAY_STAGE
 
-  const handleWebSocketMessage = useCallback((data) => {
-    console.log(data);
+  // Open the page with ?job=<jobId> to watch an evaluation started elsewhere
+  const watchJobId = new URLSearchParams(window.location.search).get('job');
+
+  // Job whose frames are being shown, resumed after a reconnect
+  const activeJobIdRef = useRef(watchJobId);
+  const sendMessageRef = useRef(null);
+
+  // Frames carry a 'seq' number; hold early arrivals until their turn
+  const pendingFramesRef = useRef(new Map());
+  const nextSeqRef = useRef(0);
+  // Set when a resume had nothing stored, so ordering starts at the next live frame
+  const adoptNextSeqRef = useRef(false);
+  const gapTimerRef = useRef(null);
+
+  // Text streamed so far, and the part frames of the complete response
+  const streamedTextRef = useRef('');
+  const finalPartsRef = useRef({});
+
+  const resetFrameOrdering = () => {
+    pendingFramesRef.current = new Map();
+    nextSeqRef.current = 0;
+    adoptNextSeqRef.current = false;
+    streamedTextRef.current = '';
+    finalPartsRef.current = {};
+  };
+
+  const requestResume = useCallback(() => {
+    if (activeJobIdRef.current && sendMessageRef.current) {
+      sendMessageRef.current({
+        action: 'resume',
+        jobId: activeJobIdRef.current,
+        fromSeq: nextSeqRef.current
+      });
+    }
+  }, []);
+
+  const finishResponse = useCallback(async (done) => {
+    try {
+      // Part frames replace the streamed text, e.g. when live frames skipped
+      // text under back-pressure or a report was reordered
+      const text = done.parts > 0
+        ? await assembleParts(finalPartsRef.current, done.parts, done.encoding)
+        : streamedTextRef.current;
+      if (!(await matchesDigest(text, done))) {
+        throw new Error('Response does not match its digest');
+      }
+      setResult(text);
+      setSuccess('Evaluation completed successfully!');
+    } catch (err) {
+      console.error(err);
+      setError('The response arrived incomplete. Please try again.');
+    }
+    finalPartsRef.current = {};
+    setIsLoading(false);
+  }, []);
+
+  const applyFrame = useCallback((data) => {
+    if (typeof data.part === 'number') {
+      finalPartsRef.current[data.part] = data;
+      return;
+    }
     if (data.chunk) {
+      streamedTextRef.current += data.chunk;
       setResult(prevResult => prevResult ? prevResult + data.chunk : data.chunk);
     }
     if (data.done === true) {
+      if (typeof data.sha256 === 'string') {
+        finishResponse(data);
+        return;
+      }
+      // Live frames may skip text under back-pressure; the final frame is complete
+      if (typeof data.fullResponse === 'string') {
+        setResult(data.fullResponse);
+      }
       setIsLoading(false);
       setSuccess('Evaluation completed successfully!');
     }
     if (data.error) {
+      setError('The evaluation failed. Please try again.');
       setIsLoading(false);
     }
-  }, []); 
+  }, [finishResponse]);
+
+  const drainFrames = useCallback(() => {
+    const pending = pendingFramesRef.current;
+    while (pending.has(nextSeqRef.current)) {
+      const frame = pending.get(nextSeqRef.current);
+      pending.delete(nextSeqRef.current);
+      nextSeqRef.current += 1;
+      applyFrame(frame);
+    }
+  }, [applyFrame]);
+
+  const handleWebSocketMessage = useCallback((data) => {
+    console.log(data);
+    const pending = pendingFramesRef.current;
+    if (data.resumed) {
+      if (data.replayed === 0) {
+        adoptNextSeqRef.current = true;
+        if (pending.size > 0) {
+          nextSeqRef.current = Math.min(...pending.keys());
+          adoptNextSeqRef.current = false;
+          drainFrames();
+        }
+      }
+      return;
+    }
+    if (typeof data.seq !== 'number') {
+      applyFrame(data);
+      return;
+    }
+    if (adoptNextSeqRef.current) {
+      nextSeqRef.current = data.seq;
+      adoptNextSeqRef.current = false;
+    }
+    // Replays and catch-ups can repeat frames already shown
+    if (data.seq < nextSeqRef.current) {
+      return;
+    }
+    pending.set(data.seq, data);
+    drainFrames();
+
+    // A frame that stays missing was lost while reconnecting; ask for it again
+    clearTimeout(gapTimerRef.current);
+    if (pending.size > 0) {
+      const waitingFor = nextSeqRef.current;
+      gapTimerRef.current = setTimeout(() => {
+        if (nextSeqRef.current === waitingFor && pendingFramesRef.current.size > 0) {
+          requestResume();
+        }
+      }, 3000);
+    }
+  }, [applyFrame, drainFrames, requestResume]);
   
   const { 
-    connectionId
+    connectionId,
+    isWebSocketConnected,
+    sendMessage
   } = useWebSocket(handleWebSocketMessage);
+  sendMessageRef.current = sendMessage;
+
+  // Catch up on the active job whenever the socket (re)connects
+  useEffect(() => {
+    if (isWebSocketConnected && activeJobIdRef.current && (watchJobId || isLoading)) {
+      requestResume();
+      setIsLoading(true);
+    }
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [isWebSocketConnected, watchJobId, requestResume]);
 
   useEffect(() => {
     // Load saved prompts
@@ -129,6 +262,7 @@ function DocumentDemo() {
     setError(null);
     setSuccess(null);
     setResult('');
+    resetFrameOrdering();
 
     try {
       // Prepare the payload
@@ -138,6 +272,8 @@ function DocumentDemo() {
         stage: API_STAGE,
         domainName: domainName,
         file: file ? await fileToBase64(file) : null,
+        fileName: file ? file.name : null,
+        contentType: file ? file.type || 'application/pdf' : null,
         prompt: prompt,
         type: 'evaluation' // Add a type to distinguish this from other websocket messages
       };
@@ -157,10 +293,20 @@ function DocumentDemo() {
       if (!response.ok) {
         throw new Error(data.error || `HTTP error! status: ${response.status}`);
       }
+      activeJobIdRef.current = data.jobId || null;
 
-      setResult(data.response);
-      setSuccess('Evaluation completed successfully!');
-      setIsLoading(false);
+      // An identical evaluation was already running; replay what it has
+      // streamed so far, the rest arrives live
+      if (data.coalesced) {
+        requestResume();
+      }
+
+      // An async start only returns the job id; the result arrives as frames
+      if (typeof data.response === 'string') {
+        setResult(data.response);
+        setSuccess('Evaluation completed successfully!');
+        setIsLoading(false);
+      }
 
     } catch (err) {
       setError('An error occurred during evaluation. Please try again.');
@@ -0,0 +1,90 @@
+# Local stand-in for the bedrock-runtime client, for running the evaluator
+# without AWS credentials (e.g. `evaluate_pdfs.py --client stub`)
+import hashlib
+import os
+import random
+import threading
+import time
+from botocore.exceptions import ClientError
+
+
+class StubBedrockClient:
+    """Answers converse and converse_stream with canned text derived from the
+    request, streamed in chunk_chars pieces with an optional delay per chunk"""
+
+    def __init__(self, response_text=None, chunk_chars=20, chunk_delay=0.0):
+        self.response_text = response_text
+        self.chunk_chars = chunk_chars
+        self.chunk_delay = chunk_delay
+        self.calls = 0
+
+    def _answer(self, modelId, messages):
+        self.calls += 1
+        if self.response_text is not None:
+            return self.response_text
+        digest = hashlib.sha256()
+        for block in messages[-1]['content']:
+            if 'document' in block:
+                digest.update(block['document']['source']['bytes'])
+            elif 'text' in block:
+                digest.update(block['text'].encode('utf-8'))
+        return f"Stub evaluation by {modelId} of request {digest.hexdigest()[:12]}."
+
+    def converse(self, modelId, messages, inferenceConfig=None, **kwargs):
+        text = self._answer(modelId, messages)
+        return {
+            'output': {'message': {'role': 'assistant', 'content': [{'text': text}]}},
+            'stopReason': 'end_turn',
+            'usage': {'inputTokens': 0, 'outputTokens': len(text.split()), 'totalTokens': len(text.split())}
+        }
+
+    def converse_stream(self, modelId, messages, inferenceConfig=None, **kwargs):
+        text = self._answer(modelId, messages)
+        return {'stream': self._events(text)}
+
+    def _events(self, text):
+        yield {'messageStart': {'role': 'assistant'}}
+        for start in range(0, len(text), self.chunk_chars):
+            if self.chunk_delay:
+                time.sleep(self.chunk_delay)
+            yield {'contentBlockDelta': {'contentBlockIndex': 0, 'delta': {'text': text[start:start + self.chunk_chars]}}}
+        yield {'contentBlockStop': {'contentBlockIndex': 0}}
+        yield {'messageStop': {'stopReason': 'end_turn'}}
+        yield {'metadata': {
+            'usage': {'inputTokens': 0, 'outputTokens': len(text.split()), 'totalTokens': len(text.split())},
+            'metrics': {'latencyMs': 0}
+        }}
+
+
+class ThrottlingStubClient(StubBedrockClient):
+    """StubBedrockClient that rejects a share of calls with
+    ThrottlingException, to exercise the admission and retry path"""
+
+    def __init__(self, throttle_rate=0.3, seed=None, **kwargs):
+        super().__init__(**kwargs)
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    def _maybe_throttle(self, operation):
+        with self.lock:
+            throttled = self.random.random() < self.throttle_rate
+            if throttled:
+                self.throttled += 1
+        if throttled:
+            raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Too many requests'}},
+                              operation)
+
+    def converse(self, modelId, messages, inferenceConfig=None, **kwargs):
+        self._maybe_throttle('Converse')
+        return super().converse(modelId, messages, inferenceConfig, **kwargs)
+
+    def converse_stream(self, modelId, messages, inferenceConfig=None, **kwargs):
+        self._maybe_throttle('ConverseStream')
+        return super().converse_stream(modelId, messages, inferenceConfig, **kwargs)
+
+
+def throttling_client():
+    """Factory for `evaluate_pdfs.py --client bedrock_stub:throttling_client`"""
+    return ThrottlingStubClient(throttle_rate=float(os.getenv('STUB_THROTTLE_RATE', '0.3')))
@@ -0,0 +1,150 @@
+# Headless batch runner: evaluates every PDF under a directory with the same
+# engine as the Streamlit app and appends one JSON line per document.
+#
+#   python evaluate_pdfs.py ./corpus --prompt-title "Grant rubric" --output results.jsonl
+#
+# The output file is also the checkpoint: rerunning with the same output
+# skips documents already evaluated with the same model and prompt.
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import evaluator
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate a directory of PDFs with Amazon Bedrock")
+    parser.add_argument('input_dir', help="Directory searched recursively for *.pdf")
+    parser.add_argument('--output', default='results.jsonl', help="JSONL results file, also used to resume")
+    prompt = parser.add_mutually_exclusive_group()
+    prompt.add_argument('--prompt', help="Prompt text")
+    prompt.add_argument('--prompt-file', help="File containing the prompt")
+    prompt.add_argument('--prompt-title', help="Title of a prompt in the prompts table")
+    parser.add_argument('--model', default=evaluator.DEFAULT_MODEL_ID,
+                        help="Model id or one of: " + ', '.join(evaluator.BEDROCK_MODELS))
+    parser.add_argument('--workers', type=int, default=4, help="Documents evaluated at once")
+    parser.add_argument('--no-chunked', action='store_true', help="Never split large PDFs into page ranges")
+    parser.add_argument('--client', default='bedrock',
+                        help="'bedrock', 'stub', or module:factory returning a bedrock-runtime compatible client")
+    return parser.parse_args(argv)
+
+def load_prompt(args):
+    if args.prompt:
+        return args.prompt
+    if args.prompt_file:
+        with open(args.prompt_file, encoding='utf-8') as f:
+            return f.read()
+    if args.prompt_title:
+        item = evaluator.get_prompt(evaluator.initialize_dynamodb(), args.prompt_title)
+        if item is None:
+            raise SystemExit(f"No prompt titled '{args.prompt_title}' in {evaluator.PROMPTS_TABLE_NAME}")
+        return item['prompt']
+    return evaluator.DEFAULT_PROMPT
+
+def create_client(spec):
+    if spec == 'bedrock':
+        return evaluator.initialize_bedrock_client()
+    if spec == 'stub':
+        from bedrock_stub import StubBedrockClient
+        return StubBedrockClient()
+    module_name, _, factory = spec.partition(':')
+    return getattr(importlib.import_module(module_name), factory or 'create_client')()
+
+def find_pdfs(input_dir):
+    paths = []
+    for directory, _, files in os.walk(input_dir):
+        for name in files:
+            if name.lower().endswith('.pdf'):
+                paths.append(os.path.relpath(os.path.join(directory, name), input_dir))
+    return sorted(paths)
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+def load_checkpoint(output_path):
+    """Return the (file, document hash, model, prompt hash) of every
+    successful record already in the output"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short by an interruption
+                continue
+            if record.get('status') == 'ok':
+                done.add((record['file'], record['documentSha256'], record['modelId'], record['promptSha256']))
+    return done
+
+def evaluate_file(client, input_dir, path, model_id, prompt, chunked_mode, cache):
+    with open(os.path.join(input_dir, path), 'rb') as f:
+        pdf_content = f.read()
+    record = {
+        'file': path,
+        'documentSha256': sha256(pdf_content),
+        'modelId': model_id,
+        'promptSha256': sha256(prompt.encode('utf-8'))
+    }
+    start = time.monotonic()
+    try:
+        result = evaluator.process_pdf_with_bedrock(pdf_content, client, model_id=model_id, prompt=prompt,
+                                                    chunked_mode=chunked_mode, cache=cache)
+        record.update(status='ok', response=result.text, cached=result.cached, chunked=result.chunked,
+                      metrics=result.metrics)
+    except Exception as e:
+        record.update(status='error', error=str(e))
+    record['elapsedMs'] = round((time.monotonic() - start) * 1000, 1)
+    return record
+
+def main(argv=None):
+    args = parse_args(argv)
+    model_id = evaluator.resolve_model(args.model)
+    prompt = load_prompt(args)
+    prompt_hash = sha256(prompt.encode('utf-8'))
+    client = create_client(args.client)
+    cache = evaluator.new_response_cache()
+
+    done = load_checkpoint(args.output)
+    todo = []
+    for path in find_pdfs(args.input_dir):
+        with open(os.path.join(args.input_dir, path), 'rb') as f:
+            key = (path, sha256(f.read()), model_id, prompt_hash)
+        if key not in done:
+            todo.append(path)
+    print(f"{len(todo)} to evaluate, {len(done)} already in {args.output}", file=sys.stderr)
+
+    failed = 0
+    pool = ThreadPoolExecutor(max_workers=args.workers)
+    try:
+        with open(args.output, 'a', encoding='utf-8') as out:
+            futures = [
+                pool.submit(evaluate_file, client, args.input_dir, path, model_id, prompt,
+                            not args.no_chunked, cache)
+                for path in todo
+            ]
+            for count, future in enumerate(as_completed(futures), start=1):
+                record = future.result()
+                # One complete line per document, on disk before moving on
+                out.write(json.dumps(record) + '\n')
+                out.flush()
+                os.fsync(out.fileno())
+                if record['status'] != 'ok':
+                    failed += 1
+                print(f"[{count}/{len(todo)}] {record['status']} {record['file']} ({record['elapsedMs']} ms)",
+                      file=sys.stderr)
+    except KeyboardInterrupt:
+        print("Interrupted, rerun the same command to resume", file=sys.stderr)
+        pool.shutdown(wait=False, cancel_futures=True)
+        return 130
+    pool.shutdown()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,314 @@
+# Evaluation engine shared by the Streamlit app and the batch CLI. Nothing
+# here depends on Streamlit: callers pass in the Bedrock client, prompt and
+# model id, and receive streamed text through callbacks.
+import boto3
+import hashlib
+import io
+import json
+import os
+import sys
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.errors import PyPdfError
+
+# The response cache, metrics, prompt caching and Bedrock throttling come
+# from the Lambda shared layer. The Docker image copies those modules next
+# to this file; a checkout imports them from backend/lambda/shared.
+SHARED_MODULES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'lambda', 'shared')
+if os.path.isdir(SHARED_MODULES_DIR) and SHARED_MODULES_DIR not in sys.path:
+    sys.path.append(SHARED_MODULES_DIR)
+
+import cache
+import metrics
+import prompt_cache
+import throttle
+
+# Add model options
+BEDROCK_MODELS = {
+    "Claude 3.5 Sonnet": "anthropic.claude-3-5-sonnet-20240620-v1:0",
+    "Claude 3 Haiku": "anthropic.claude-3-haiku-20240307-v1:0"
+}
+DEFAULT_MODEL_ID = BEDROCK_MODELS["Claude 3.5 Sonnet"]
+
+DEFAULT_PROMPT = """Please analyze and summarize the content of this PDF document.
+    Focus on the main points and key findings. Provide a clear and concise summary."""
+
+INFERENCE_CONFIG = {
+    "maxTokens": 2000,
+    "temperature": 0
+}
+
+# Deterministic (temperature 0) evaluations are cached for every session
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv('RESPONSE_CACHE_TTL_SECONDS', '3600'))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '64'))
+
+# Large PDFs are split into page ranges that are evaluated concurrently and
+# then merged into one report
+CHUNK_PAGES = int(os.getenv('CHUNK_PAGES', '10'))
+CHUNK_MAX_WORKERS = int(os.getenv('CHUNK_MAX_WORKERS', '4'))
+
+# The evaluation comes first in every page range request so the same prefix
+# can be served from the Bedrock prompt cache for each range
+CHUNK_EVALUATION = """<evaluation>
+{prompt}
+</evaluation>"""
+
+CHUNK_INSTRUCTIONS = """The attached file is pages {first}-{last} of a larger document.
+Review only these pages against the evaluation above. List the findings for each
+criterion that these pages cover, quoting the relevant evidence, and list the
+criteria these pages do not address. Do not give an overall rating."""
+
+REDUCE_INSTRUCTIONS = """A document was reviewed in page ranges. The findings for each
+range are below. A criterion is met if any range meets it. Merge the findings into
+the final evaluation requested below, as if you had reviewed the whole document.
+
+<findings>
+{findings}
+</findings>
+
+<evaluation>
+{prompt}
+</evaluation>"""
+
+PROMPTS_TABLE_NAME = os.getenv('PROMPTS_TABLE_NAME', 'tr-agent-prompts')
+
+# Per-evaluation metrics are printed as CloudWatch EMF ('emf'), kept in
+# metrics.local_records ('local') or not emitted ('none')
+METRICS_SINK = os.getenv('METRICS_SINK', 'emf')
+if METRICS_SINK == 'none':
+    metrics.set_sink(lambda record: None)
+
+Evaluation = namedtuple('Evaluation', ['text', 'cached', 'chunked', 'metrics'])
+
+
+def initialize_bedrock_client():
+    region = os.getenv('BEDROCK_REGION', 'ap-southeast-1')
+    bedrock_runtime = boto3.client('bedrock-runtime', region)
+    return bedrock_runtime
+
+def initialize_dynamodb():
+    dynamodb = boto3.resource('dynamodb')
+    return dynamodb
+
+def resolve_model(name_or_id):
+    """Accept either a BEDROCK_MODELS display name or a model id"""
+    return BEDROCK_MODELS.get(name_or_id, name_or_id)
+
+
+def new_response_cache():
+    """In-memory LRU of evaluation results with a TTL, shared by all sessions"""
+    return cache.TTLCache(max_entries=RESPONSE_CACHE_MAX_ENTRIES, ttl_seconds=RESPONSE_CACHE_TTL_SECONDS)
+
+def response_cache_key(model_id, prompt, inference_config, pdf_content, mode=None):
+    """Content-addressed key for a deterministic evaluation, or None"""
+    if inference_config.get('temperature') != 0:
+        return None
+    return hashlib.sha256(json.dumps({
+        'modelId': model_id,
+        'prompt': prompt,
+        'inferenceConfig': inference_config,
+        'document': hashlib.sha256(pdf_content).hexdigest(),
+        'mode': mode
+    }, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def list_prompt_titles(dynamodb):
+    """Page through the prompts table, fetching only the titles"""
+    table = dynamodb.Table(PROMPTS_TABLE_NAME)
+    scan_kwargs = {
+        'ProjectionExpression': '#title',
+        'ExpressionAttributeNames': {'#title': 'title'}
+    }
+    titles = []
+    while True:
+        response = table.scan(**scan_kwargs)
+        titles.extend(item['title'] for item in response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return [{'title': title} for title in sorted(titles)]
+
+def get_prompt(dynamodb, title):
+    """Load the full prompt item for a title"""
+    table = dynamodb.Table(PROMPTS_TABLE_NAME)
+    response = table.get_item(Key={'title': title})
+    return response.get('Item')
+
+def put_prompt(dynamodb, title, prompt_text):
+    table = dynamodb.Table(PROMPTS_TABLE_NAME)
+    table.put_item(Item={
+        'title': title,
+        'prompt': prompt_text
+    })
+
+
+def read_pdf(pdf_content):
+    """Parse a PDF for splitting, or return None when PyPDF2 cannot read it;
+    Bedrock may still accept the whole document"""
+    try:
+        reader = PdfReader(io.BytesIO(pdf_content))
+        len(reader.pages)
+        return reader
+    except PyPdfError:
+        return None
+
+def split_pdf(reader, pages_per_chunk):
+    """Split a parsed PDF into (first_page, last_page, pdf_bytes) page ranges"""
+    page_count = len(reader.pages)
+    chunks = []
+    for start in range(0, page_count, pages_per_chunk):
+        end = min(start + pages_per_chunk, page_count)
+        writer = PdfWriter()
+        for index in range(start, end):
+            writer.add_page(reader.pages[index])
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        chunks.append((start + 1, end, buffer.getvalue()))
+    return chunks
+
+def evaluate_pdf_chunk(bedrock_client, model_id, prompt, chunk, inference_config, metrics=None):
+    """Map step: collect the findings for one page range"""
+    first, last, chunk_bytes = chunk
+    response = throttle.converse(
+        bedrock_client,
+        metrics=metrics,
+        modelId=model_id,
+        messages=[{
+            "role": "user",
+            "content": prompt_cache.content(
+                model_id,
+                [{ "text": CHUNK_EVALUATION.format(prompt=prompt) }],
+                [
+                    {
+                        "document": {
+                            "name": f"Pages {first}-{last}",
+                            "format": "pdf",
+                            "source": {
+                                "bytes": chunk_bytes
+                            }
+                        }
+                    },
+                    { "text": CHUNK_INSTRUCTIONS.format(first=first, last=last) }
+                ]
+            )
+        }],
+        inferenceConfig=inference_config,
+    )
+    if metrics is not None:
+        metrics.usage(response.get('usage', {}), response.get('metrics', {}).get('latencyMs'))
+    return response['output']['message']['content'][0]['text']
+
+def stream_text(response_stream, on_text=None, metrics=None):
+    """Collect the text deltas of a converse_stream response, passing each
+    one to on_text as it arrives"""
+    parts = []
+    for chunk in response_stream["stream"]:
+        if metrics is not None:
+            metrics.stream_event(chunk)
+        if "contentBlockDelta" in chunk:
+            text_chunk = chunk["contentBlockDelta"]["delta"]["text"]
+            parts.append(text_chunk)
+            if on_text:
+                on_text(text_chunk)
+    return ''.join(parts)
+
+def process_pdf_chunked(reader, bedrock_client, model_id, prompt, inference_config,
+                        on_text=None, on_chunk=None, metrics=None):
+    """Evaluate page ranges concurrently, then stream a reduce pass that
+    merges the per-range findings into the final report.
+    on_chunk(first, last, findings, done, total) is called on the calling
+    thread as each range finishes."""
+    chunks = split_pdf(reader, CHUNK_PAGES)
+    findings = {}
+
+    with ThreadPoolExecutor(max_workers=min(CHUNK_MAX_WORKERS, len(chunks))) as pool:
+        futures = {
+            pool.submit(evaluate_pdf_chunk, bedrock_client, model_id, prompt, chunk, inference_config, metrics): chunk
+            for chunk in chunks
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            first, last, _ = futures[future]
+            findings[first] = (last, future.result())
+            if on_chunk:
+                on_chunk(first, last, findings[first][1], done, len(chunks))
+
+    merged_findings = "\n\n".join(
+        f"<pages range=\"{first}-{last}\">\n{text}\n</pages>"
+        for first, (last, text) in sorted(findings.items())
+    )
+    if metrics is not None:
+        metrics.stream_started()
+    response_stream = throttle.converse_stream(
+        bedrock_client,
+        metrics=metrics,
+        modelId=model_id,
+        messages=[{
+            "role": "user",
+            "content": [{ "text": REDUCE_INSTRUCTIONS.format(findings=merged_findings, prompt=prompt) }]
+        }],
+        inferenceConfig=inference_config,
+    )
+    return stream_text(response_stream, on_text, metrics)
+
+def process_pdf_with_bedrock(pdf_content, bedrock_client, model_id=DEFAULT_MODEL_ID, prompt=None,
+                             chunked_mode=True, cache=None, bypass_cache=False,
+                             on_text=None, on_chunk=None):
+    """Evaluate a PDF with the prompt and return an Evaluation. Streamed text
+    goes to on_text; on a cache hit the whole text is returned and on_text is
+    not called."""
+    prompt = prompt or DEFAULT_PROMPT
+
+    doc_message = {
+            "role": "user",
+            "content": prompt_cache.content(
+                model_id,
+                [{ "text": "Based on the document, " + prompt }],
+                [
+                    {
+                        "document": {
+                            "name": "Document 1",
+                            "format": "pdf",
+                            "source": {
+                                "bytes": pdf_content
+                            }
+                        }
+                    }
+                ]
+            )
+        }
+
+    inference_config = dict(INFERENCE_CONFIG)
+
+    # Chunk large documents into page ranges when chunked mode is on; PDFs
+    # that cannot be parsed are evaluated whole
+    reader = read_pdf(pdf_content) if chunked_mode else None
+    chunked = reader is not None and len(reader.pages) > CHUNK_PAGES
+
+    # Replay a previous result for the same model, prompt and document
+    cache_key = response_cache_key(model_id, prompt, inference_config, pdf_content,
+                                   mode=f"chunked-{CHUNK_PAGES}" if chunked else None)
+    cached_response = None if cache is None or cache_key is None or bypass_cache else cache.get(cache_key)
+    if cached_response is not None:
+        return Evaluation(cached_response, True, chunked, {})
+
+    request_metrics = metrics.RequestMetrics('evaluate-pdf', model_id, chunked=chunked)
+    if chunked:
+        full_response = process_pdf_chunked(reader, bedrock_client, model_id, prompt,
+                                            inference_config, on_text, on_chunk, request_metrics)
+    else:
+        request_metrics.stream_started()
+        response_stream = throttle.converse_stream(
+                bedrock_client,
+                metrics=request_metrics,
+                modelId=model_id,
+                messages=[doc_message],
+                inferenceConfig=inference_config,
+            )
+        full_response = stream_text(response_stream, on_text, request_metrics)
+    request_metrics.emit()
+
+    if cache is not None and cache_key is not None and full_response:
+        cache.put(cache_key, full_response)
+    summary = {name: round(value, 3) for name, (unit, value) in request_metrics.summary().items()}
+    return Evaluation(full_response, False, chunked, summary)
@@ -1,7 +1,7 @@
 import streamlit as st
-import boto3
-import base64
 import os
+import time
+import evaluator
 
 # Initialize session state for prompts
 if 'prompts' not in st.session_state:
@@ -15,25 +15,75 @@ if 'editing' not in st.session_state:
 if 'edited_prompt' not in st.session_state:
     st.session_state.edited_prompt = None
 if 'selected_model' not in st.session_state:
-    st.session_state.selected_model = "anthropic.claude-3-5-sonnet-20240620-v1:0"
+    st.session_state.selected_model = evaluator.DEFAULT_MODEL_ID
+if 'bypass_cache' not in st.session_state:
+    st.session_state.bypass_cache = False
+if 'chunked_mode' not in st.session_state:
+    st.session_state.chunked_mode = True
 
 
 # Add model options
-BEDROCK_MODELS = {
-    "Claude 3.5 Sonnet": "anthropic.claude-3-5-sonnet-20240620-v1:0",
-    "Claude 3 Haiku": "anthropic.claude-3-haiku-20240307-v1:0"
-}
+BEDROCK_MODELS = evaluator.BEDROCK_MODELS
+
+# Streaming output is re-rendered at most STREAM_RENDER_FPS times per second,
+# or every STREAM_RENDER_EVERY_CHARS characters when that is set
+STREAM_RENDER_FPS = float(os.getenv('STREAM_RENDER_FPS', '8'))
+STREAM_RENDER_EVERY_CHARS = int(os.getenv('STREAM_RENDER_EVERY_CHARS', '0'))
+
+# Prompt store reads are cached for every session and invalidated on write
+PROMPT_CACHE_TTL_SECONDS = int(os.getenv('PROMPT_CACHE_TTL_SECONDS', '300'))
 
 
 def initialize_bedrock_client():
-    region = os.getenv('BEDROCK_REGION', 'ap-southeast-1')
-    bedrock_runtime = boto3.client('bedrock-runtime', region)
-    return bedrock_runtime
+    return evaluator.initialize_bedrock_client()
 
+@st.cache_resource
 def initialize_dynamodb():
-    """Initialize DynamoDB client"""
-    dynamodb = boto3.resource('dynamodb')
-    return dynamodb
+    """Initialize DynamoDB client once per process"""
+    return evaluator.initialize_dynamodb()
+
+@st.cache_resource
+def get_response_cache():
+    """Process-wide LRU of evaluation results, shared by all sessions"""
+    return evaluator.new_response_cache()
+
+class StreamRenderer:
+    """Accumulates streamed text in a list buffer and re-renders the
+    placeholder at a capped rate instead of after every delta"""
+
+    def __init__(self, placeholder, max_fps=STREAM_RENDER_FPS, every_chars=STREAM_RENDER_EVERY_CHARS):
+        self.placeholder = placeholder
+        self.min_interval = 1.0 / max_fps if max_fps > 0 else 0
+        self.every_chars = every_chars
+        self.renders = 0
+        self._parts = []
+        self._pending_chars = 0
+        self._last_render = 0.0
+
+    @property
+    def text(self):
+        return ''.join(self._parts)
+
+    def add(self, text_chunk):
+        self._parts.append(text_chunk)
+        self._pending_chars += len(text_chunk)
+        if self.every_chars > 0:
+            due = self._pending_chars >= self.every_chars
+        else:
+            due = time.monotonic() - self._last_render >= self.min_interval
+        if due:
+            self._render()
+
+    def finish(self):
+        """Render the complete text and return it"""
+        self._render()
+        return self.text
+
+    def _render(self):
+        self.placeholder.markdown(self.text)
+        self.renders += 1
+        self._pending_chars = 0
+        self._last_render = time.monotonic()
 
 def handle_form_submission():
     if st.session_state.new_title and st.session_state.new_prompt:
@@ -41,15 +91,24 @@ def handle_form_submission():
             st.session_state.form_submitted = True
             st.rerun()
 
+@st.cache_data(ttl=PROMPT_CACHE_TTL_SECONDS, show_spinner=False)
+def list_prompt_titles():
+    """Page through the prompts table, fetching only the titles"""
+    return evaluator.list_prompt_titles(initialize_dynamodb())
+
+@st.cache_data(ttl=PROMPT_CACHE_TTL_SECONDS, show_spinner=False)
+def get_prompt(title):
+    """Load the full prompt item for a title"""
+    return evaluator.get_prompt(initialize_dynamodb(), title)
+
+def invalidate_prompt_cache():
+    list_prompt_titles.clear()
+    get_prompt.clear()
+
 def load_prompts():
-    """Load prompts directly from DynamoDB"""
+    """Load the prompt titles, cached across reruns and sessions"""
     try:
-        dynamodb = initialize_dynamodb()
-        table = dynamodb.Table('tr-agent-prompts')
-        
-        response = table.scan()
-        
-        prompts = response.get('Items', [])
+        prompts = list_prompt_titles()
         st.session_state.prompts = prompts
         return prompts
     except Exception as e:
@@ -68,15 +127,8 @@ def save_prompt(title, prompt_text, is_update=False):
                 st.error(f"A prompt with title '{title}' already exists. Please choose a different title.")
                 return False
 
-        dynamodb = initialize_dynamodb()
-        table = dynamodb.Table('tr-agent-prompts')
-        
-        item = {
-            'title': title,
-            'prompt': prompt_text
-        }
-        
-        table.put_item(Item=item)
+        evaluator.put_prompt(initialize_dynamodb(), title, prompt_text)
+        invalidate_prompt_cache()
         st.success("Prompt {} successfully!".format("updated" if is_update else "saved"))
         
         # Reload prompts and update session state
@@ -103,50 +155,45 @@ def process_pdf_with_bedrock(pdf_content, bedrock_client):
 
     # Initialize the placeholder for streaming output
     output_placeholder = st.empty()
-    
-    # Encode PDF content to base64
-    pdf_base64 = base64.b64encode(pdf_content).decode('utf-8')
-    
+
     # Use the selected prompt or default prompt
-    prompt = st.session_state.selected_prompt['prompt'] if st.session_state.selected_prompt else """Please analyze and summarize the content of this PDF document. 
-    Focus on the main points and key findings. Provide a clear and concise summary."""
-    
-    doc_message = {
-            "role": "user",
-            "content": [
-                {
-                    "document": {
-                        "name": "Document 1",
-                        "format": "pdf",
-                        "source": {
-                            "bytes": pdf_content
-                        }
-                    }
-                },
-                { "text": "Based on the document, " + prompt }
-            ]
-        }
-    
+    prompt = st.session_state.selected_prompt['prompt'] if st.session_state.selected_prompt else evaluator.DEFAULT_PROMPT
+
+    # Render chunks as they arrive, throttled to keep the browser responsive
+    renderer = StreamRenderer(output_placeholder)
+    progress = None
+
+    def show_chunk(first, last, findings, done, total):
+        # Streamlit calls stay on this thread; workers only talk to Bedrock
+        nonlocal progress
+        if progress is None:
+            progress = st.progress(0.0, text=f"Evaluating {total} page ranges...")
+        progress.progress(done / total, text=f"Evaluated pages {first}-{last} ({done}/{total})")
+        with st.expander(f"Findings for pages {first}-{last}"):
+            st.markdown(findings)
+
     try:
-        response_stream = bedrock_client.converse_stream(
-                modelId=modelID,
-                messages=[doc_message],
-                inferenceConfig={
-                    "maxTokens": 2000,
-                    "temperature": 0
-                },
-            )
-            
-        # For WebSocket requests, send each chunk as it arrives
-        full_response = ""
-
-        for chunk in response_stream["stream"]:
-            if "contentBlockDelta" in chunk:
-                text_chunk = chunk["contentBlockDelta"]["delta"]["text"]
-                full_response += text_chunk
-                output_placeholder.markdown(full_response)
-                    
-        return full_response
+        result = evaluator.process_pdf_with_bedrock(
+            pdf_content,
+            bedrock_client,
+            model_id=modelID,
+            prompt=prompt,
+            chunked_mode=st.session_state.chunked_mode,
+            cache=get_response_cache(),
+            bypass_cache=st.session_state.bypass_cache,
+            on_text=renderer.add,
+            on_chunk=show_chunk
+        )
+        if result.cached:
+            output_placeholder.markdown(result.text)
+            st.caption("Served from the response cache")
+            return result.text
+        renderer.finish()
+        if 'TimeToFirstToken' in result.metrics:
+            st.caption(f"First token after {result.metrics['TimeToFirstToken']:.0f} ms, "
+                       f"{result.metrics.get('InputTokens', 0):.0f} input / "
+                       f"{result.metrics.get('OutputTokens', 0):.0f} output tokens")
+        return result.text
     
     except Exception as e:
         st.error(f"Error processing PDF: {str(e)}")
@@ -205,9 +252,8 @@ def main():
     # Initialize Bedrock client
     bedrock_client = initialize_bedrock_client()
     
-    # Load prompts when the app starts
-    if len(st.session_state.prompts) == 0:
-        load_prompts()
+    # Load prompt titles; served from the cache on most reruns
+    load_prompts()
     
     # Move prompt management to sidebar
     with st.sidebar:
@@ -221,6 +267,17 @@ def main():
         )
         
         st.session_state.selected_model = BEDROCK_MODELS[selected_model_name]
+
+        st.checkbox(
+            "Bypass response cache",
+            key="bypass_cache",
+            help="Always call Bedrock, even if this document was evaluated with the same prompt and model before"
+        )
+        st.checkbox(
+            "Chunked evaluation for large PDFs",
+            key="chunked_mode",
+            help=f"Evaluate PDFs longer than {evaluator.CHUNK_PAGES} pages in page ranges, in parallel, then merge the findings"
+        )
         
         st.markdown("---")
 
@@ -234,7 +291,12 @@ def main():
                 prompt_titles,
                 key="prompt_selector"
             )
-            selected_prompt = next((p for p in st.session_state.prompts if p['title'] == selected_title), None)
+            # The prompt body is only loaded for the selected title
+            try:
+                selected_prompt = get_prompt(selected_title)
+            except Exception as e:
+                st.error(f"Error loading prompt: {str(e)}")
+                selected_prompt = None
             st.session_state.selected_prompt = selected_prompt
             
             if selected_prompt: